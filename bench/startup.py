@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+"""
+Benchmarks pinstall startup time, command import time, and peak memory.
+
+Runs `pinstall -h` and `pinstall <command> -h` for every command as
+separate processes to measure cold startup (fresh bytecode for this
+program and manifest cache, but with the standard library already
+compiled) and warm startup time, plus peak RSS. Also measures the time to
+import each command module and to run its init() to set up its parser.
+Results are written as JSON so they can be compared across releases.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+
+TOP = Path(__file__).resolve().parent.parent
+PROG = 'pinstall'
+RESULTS = Path(__file__).parent / 'results'
+
+# Child code to time import of given command module and its init()
+IMPORT_CODE = """\
+import argparse, importlib, json, sys, time
+name = sys.argv[1]
+start = time.perf_counter()
+mod = importlib.import_module(f'{prog}.commands.{{name}}')
+imported = time.perf_counter()
+if hasattr(mod, 'init'):
+    mod.init(argparse.ArgumentParser())
+done = time.perf_counter()
+print(json.dumps({{'import': imported - start, 'init': done - imported}}))
+"""
+
+
+def get_commands() -> list[str]:
+    "Return list of command names, without importing them"
+    return [p.stem for p in sorted((TOP / PROG / 'commands').glob('[!_]*.py'))]
+
+
+def get_version() -> str:
+    "Return a version string for this source tree"
+    res = subprocess.run(
+        ['git', 'describe', '--tags', '--always', '--dirty'],
+        cwd=TOP,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    return res.stdout.strip() if res.returncode == 0 else 'unknown'
+
+
+def run_once(args: list[str], env: dict[str, str]) -> tuple[float, int]:
+    "Run pinstall once with given args, return elapsed secs and peak RSS in KB"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', PROG, *args],
+        cwd=TOP,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    proc.returncode = (
+        os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    )
+    if proc.returncode != 0:
+        sys.exit(f'Error: "{PROG} {" ".join(args)}" failed ({proc.returncode})')
+
+    return elapsed, rusage.ru_maxrss
+
+
+def make_env(cachedir: str, pycache: str) -> dict[str, str]:
+    "Return environment with user caches in given dir, and given bytecode dir"
+    env = os.environ.copy()
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPATH'] = str(TOP)
+    env['PYTHONPYCACHEPREFIX'] = pycache
+    env['XDG_CACHE_HOME'] = str(Path(cachedir, 'cache'))
+    return env
+
+
+def clear_bytecode(pycache: str) -> None:
+    "Remove bytecode of just this program from given bytecode dir"
+    shutil.rmtree(Path(pycache, TOP.relative_to(TOP.anchor), PROG), ignore_errors=True)
+
+
+def summary(times: list[float]) -> dict[str, float]:
+    "Return summary of given list of times, in msecs"
+    return {
+        'min': round(min(times) * 1000, 2),
+        'median': round(statistics.median(times) * 1000, 2),
+    }
+
+
+def bench_startup(args: list[str], opts: Namespace, pycache: str) -> dict:
+    "Benchmark cold and warm startup of given command line"
+    # Standard library bytecode is kept across cold runs, so they only
+    # measure compiling this program and building its manifest
+    cold = []
+    for _ in range(opts.cold):
+        clear_bytecode(pycache)
+        with tempfile.TemporaryDirectory() as cachedir:
+            cold.append(run_once(args, make_env(cachedir, pycache))[0])
+
+    warm = []
+    rss = 0
+    with tempfile.TemporaryDirectory() as cachedir:
+        env = make_env(cachedir, pycache)
+        run_once(args, env)
+        for _ in range(opts.warm):
+            elapsed, maxrss = run_once(args, env)
+            warm.append(elapsed)
+            rss = max(rss, maxrss)
+
+    return {'cold_ms': summary(cold), 'warm_ms': summary(warm), 'peak_rss_kb': rss}
+
+
+def bench_import(name: str, opts: Namespace, pycache: str) -> dict:
+    "Benchmark import and init() of given command module"
+    imports = []
+    inits = []
+    with tempfile.TemporaryDirectory() as cachedir:
+        env = make_env(cachedir, pycache)
+        code = IMPORT_CODE.format(prog=PROG)
+        for n in range(opts.warm + 1):
+            res = subprocess.run(
+                [sys.executable, '-c', code, name],
+                cwd=TOP,
+                env=env,
+                stdout=subprocess.PIPE,
+                text=True,
+                check=True,
+            )
+            # Discard first run which compiles the bytecode
+            if n > 0:
+                data = json.loads(res.stdout)
+                imports.append(data['import'])
+                inits.append(data['init'])
+
+    return {'import_ms': summary(imports), 'init_ms': summary(inits)}
+
+
+def compare(old: dict, new: dict) -> None:
+    "Print comparison of warm startup times between old and new results"
+    print(f'\nComparing to {old["version"]} ({old["date"]}):')
+    for key, data in new['startup'].items():
+        olddata = old['startup'].get(key)
+        if not olddata:
+            continue
+        oldt = olddata['warm_ms']['min']
+        newt = data['warm_ms']['min']
+        pct = (newt - oldt) / oldt * 100 if oldt else 0
+        print(f'  {key:<24} {oldt:8.2f} -> {newt:8.2f} ms ({pct:+.1f}%)')
+
+
+def main() -> str | None:
+    "Main code"
+    opt = ArgumentParser(description=__doc__)
+    opt.add_argument(
+        '-c',
+        '--cold',
+        type=int,
+        default=3,
+        help='number of cold runs, default=%(default)d',
+    )
+    opt.add_argument(
+        '-w',
+        '--warm',
+        type=int,
+        default=10,
+        help='number of warm runs, default=%(default)d',
+    )
+    opt.add_argument(
+        '-o', '--output', help=f'output JSON file, default="{RESULTS}/<version>.json"'
+    )
+    opt.add_argument('-C', '--compare', help='previous JSON results file to compare to')
+    opt.add_argument(
+        'commands', nargs='*', help='only benchmark given commands, default is all'
+    )
+    opts = opt.parse_args()
+
+    commands = opts.commands or get_commands()
+    version = get_version()
+    results: dict = {
+        'version': version,
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'startup': {},
+        'commands': {},
+    }
+
+    with tempfile.TemporaryDirectory() as pycache:
+        # Compile the standard library bytecode once, before any timing
+        with tempfile.TemporaryDirectory() as cachedir:
+            run_once(['-h'], make_env(cachedir, pycache))
+
+        for args in [['-h']] + [[c, '-h'] for c in commands]:
+            key = ' '.join(args)
+            print(f'Timing "{PROG} {key}" ..')
+            results['startup'][key] = bench_startup(args, opts, pycache)
+
+        for name in commands:
+            print(f'Timing import of command "{name}" ..')
+            results['commands'][name] = bench_import(name, opts, pycache)
+
+    outfile = Path(opts.output) if opts.output else RESULTS / f'{version}.json'
+    outfile.parent.mkdir(parents=True, exist_ok=True)
+    outfile.write_text(json.dumps(results, indent=2) + '\n')
+    print(f'Results written to {outfile}')
+
+    if opts.compare:
+        compare(json.loads(Path(opts.compare).read_text()), results)
+
+    return None
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+"""
+Common module to apply a plan of systemd unit file changes.
+
+The plan is built by the service command as the invoking user, and then
+applied here. For system services this module is run as root via sudo,
+reading the plan from stdin, so only this minimal work is done as root.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Iterable
+
+from . import index
+from .manifest import Manifest
+from .run import run
+from .systemd import rollout
+
+
+def _sync_dirs(dirs: Iterable[Path]) -> None:
+    "Fsync each given directory, so renames and removals within are durable"
+    for d in dirs:
+        fd = os.open(d, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _opener(path: str, flags: int) -> int:
+    "Open given unit file with standard permissions"
+    return os.open(path, flags, 0o644)
+
+
+def write_units(units: dict[Path, str]) -> None:
+    "Write given unit files atomically, as one batch"
+    # Stage all files to temp files in their target dirs first, then
+    # sync them all, then rename them all into place, so systemd never
+    # sees a partially written unit. Each target dir is synced just once.
+    staged = []
+    try:
+        for target, content in units.items():
+            print(f'### Writing {target}')
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmpfile = target.with_name(f'.{target.name}.{os.getpid()}')
+            fp = open(tmpfile, 'wb', opener=_opener)
+            staged.append((tmpfile, target, fp))
+            fp.write(content.encode())
+
+        for _, _, fp in staged:
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        for tmpfile, target, _ in staged:
+            tmpfile.replace(target)
+    except Exception:
+        for tmpfile, _, _ in staged:
+            tmpfile.unlink(missing_ok=True)
+        raise
+    finally:
+        for _, _, fp in staged:
+            fp.close()
+
+    _sync_dirs({target.parent for target in units})
+
+
+def remove_units(units: list[Path], user: bool) -> bool:
+    "Remove given unit files, as one batch, return True if any removed"
+    removed = [unit for unit in units if unit.exists()]
+    for unit in removed:
+        unit.unlink()
+        print(f'### {unit} removed')
+
+    # Delete all empty parent dirs if user, deepest first, then sync
+    # each dir left just once
+    syncs = set()
+    dirs = {unit.parent for unit in removed}
+    for unit_dir in sorted(dirs, key=lambda d: len(d.parts), reverse=True):
+        while user:
+            try:
+                unit_dir.rmdir()
+            except FileNotFoundError:
+                pass
+            except OSError:
+                break
+            else:
+                print(f'### {unit_dir} directory removed')
+
+            unit_dir = unit_dir.parent
+
+        syncs.add(unit_dir)
+
+    _sync_dirs(d for d in syncs if d.exists())
+    return bool(removed)
+
+
+def apply(plan: dict) -> str | None:
+    "Apply given plan, return error message if any unit failed to start"
+    sysctl = plan['sysctl']
+    manifest = Manifest(Path(plan['manifest']))
+    change = False
+
+    if plan['disable']:
+        run(
+            [*sysctl, 'disable', '--now', *plan['disable']],
+            capture=True,
+            ignore_error=True,
+        )
+
+    removes = [Path(target) for target in plan['removes']]
+    if remove_units(removes, plan['user']):
+        change = True
+
+    for target in removes:
+        manifest.remove(target)
+
+    writes = {
+        Path(w['target']): w['content']
+        for w in plan['writes']
+        if w['content'] is not None
+    }
+    if writes:
+        write_units(writes)
+        change = True
+
+    for write in plan['writes']:
+        manifest.record(
+            Path(write['target']),
+            Path(write['source']),
+            write['inputs'],
+            write['hash'],
+            write['wanted'],
+        )
+
+    if change:
+        run([*sysctl, 'daemon-reload'])
+
+    # Only record units as installed once they are enabled and started, so
+    # a failed step is retried when the plan is next built
+    unitdir = Path(plan['unitdir'])
+    if plan['enable']:
+        run([*sysctl, 'enable', *plan['enable']])
+        for name in plan['enable']:
+            manifest.mark(unitdir / name, 'enabled')
+
+    failed = []
+    if plan['restart']:
+        failed = rollout(
+            sysctl, plan['restart'], jobs=plan['jobs'], timeout=plan['timeout']
+        )
+        for name in plan['restart']:
+            manifest.mark(unitdir / name, 'started', name not in failed)
+
+    manifest.save()
+
+    # Record all units in the host index of installs, once all else is done
+    indexfile = Path(plan['index'])
+    scope = 'user' if plan['user'] else 'system'
+    if removes:
+        index.remove(indexfile, 'unit', scope, [target.name for target in removes])
+
+    if plan['writes']:
+        units = [
+            (Path(w['target']).name, str(Path(w['source']).parent), w['hash'])
+            for w in plan['writes']
+        ]
+        index.record(indexfile, 'unit', scope, units, plan['username'])
+
+    if failed:
+        return f'Error: {len(failed)} unit[s] failed to start: {", ".join(failed)}'
+
+    return None
+
+
+def main() -> None:
+    "Apply plan read from stdin"
+    sys.exit(apply(json.load(sys.stdin)))
+
+
+if __name__ == '__main__':
+    main()
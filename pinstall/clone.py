@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+"Common module to quickly clone directory trees using reflinks or hardlinks"
+
+from __future__ import annotations
+
+import errno
+import os
+import shutil
+from pathlib import Path
+from typing import Callable
+
+# Linux ioctl to clone file contents by reference (i.e. copy on write)
+FICLONE = 0x40049409
+
+# Errors which mean a clone method is not supported for these files
+UNSUPPORTED = {
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EINVAL,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EMLINK,
+}
+
+
+def _reflink(src: str, dst: str) -> None:
+    "Clone given file contents by reference"
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, 'reflink not supported') from None
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+
+    shutil.copystat(src, dst)
+
+
+def _copy(src: str, dst: str) -> None:
+    "Copy given file"
+    shutil.copy2(src, dst)
+
+
+class Cloner:
+    "Clones files by reflink if supported, else hardlink, else by copying"
+
+    def __init__(self) -> None:
+        self.methods: list[Callable[[str, str], None]] = [_reflink, os.link, _copy]
+
+    @property
+    def method(self) -> str:
+        "Return name of current clone method"
+        return {_reflink: 'reflink', os.link: 'hardlink', _copy: 'copy'}[
+            self.methods[0]
+        ]
+
+    def clone(self, src: str, dst: str, *, link: bool = True) -> None:
+        "Clone given file, only hardlinking it if link is True"
+        # Drop each method as soon as it is found not to be supported
+        while True:
+            method = self.methods[0]
+            if method is os.link and not link:
+                method = _copy
+            try:
+                return method(src, dst)
+            except OSError as e:
+                if method is _copy or e.errno not in UNSUPPORTED:
+                    raise
+                self.methods.pop(0)
+
+    def clone_tree(
+        self, src: Path, dst: Path, *, copy: Callable[[Path], bool] | None = None
+    ) -> None:
+        "Clone given directory tree, copying files for which copy() is True"
+        dst.mkdir(parents=True, exist_ok=True)
+        for dirpath, dirnames, filenames in os.walk(src):
+            spath = Path(dirpath)
+            dpath = dst / spath.relative_to(src)
+            dpath.mkdir(exist_ok=True)
+            for name in dirnames + filenames:
+                sfile = spath / name
+                dfile = dpath / name
+                if sfile.is_symlink():
+                    dfile.symlink_to(os.readlink(sfile))
+                    if name in dirnames:
+                        dirnames.remove(name)
+                elif name in filenames:
+                    self.clone(str(sfile), str(dfile), link=not (copy and copy(sfile)))
@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+"""
+Reports everything installed on this host.
+
+Lists all systemd units installed by the service command, and all
+virtual environments created by the venv commands, as recorded in the
+user and system indexes of installs. Reports the source directory each
+was installed from, the user, and when it was installed (or last
+changed). Optionally only lists names matching any of the given glob
+patterns.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from argparse import ArgumentParser, Namespace
+
+from .. import index
+
+# Table columns, and their report keys
+COLUMNS = {
+    'KIND': 'kind',
+    'SCOPE': 'scope',
+    'NAME': 'name',
+    'SOURCE': 'source',
+    'USER': 'user',
+    'INSTALLED': 'installed',
+}
+
+
+def init(parser: ArgumentParser) -> None:
+    "Called to add this command's arguments to parser at init"
+    parser.add_argument(
+        '-k', '--kind', choices=('unit', 'venv'), help='only report given kind'
+    )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        '-u', '--user', action='store_true', help='only report user installs'
+    )
+    group.add_argument(
+        '-s', '--system', action='store_true', help='only report system installs'
+    )
+    parser.add_argument('-J', '--json', action='store_true', help='report as JSON')
+    parser.add_argument('patterns', nargs='*', help='name glob pattern[s]')
+
+
+def main(args: Namespace) -> str | None:
+    "Called to action this command"
+    paths = []
+    if not args.system:
+        paths.append(index.get_path(True))
+    if not args.user:
+        paths.append(index.get_path(False))
+
+    rows = index.query(paths, args.kind, args.patterns)
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return None
+
+    if not rows:
+        return 'Nothing installed'
+
+    table = [list(COLUMNS)]
+    for row in rows:
+        row['installed'] = time.strftime(
+            '%Y-%m-%d %H:%M', time.localtime(row['installed'])
+        )
+        table.append([str(row[k]) for k in COLUMNS.values()])
+
+    widths = [max(len(r[i]) for r in table) for i in range(len(COLUMNS))]
+    for line in table:
+        print('  '.join(v.ljust(w) for v, w in zip(line, widths)).rstrip())
+
+    return None
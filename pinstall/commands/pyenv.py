@@ -7,72 +7,166 @@ import os
 import string
 from argparse import ArgumentParser, Namespace
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
 
 from packaging import version
 
-from ..run import run
+from ..probe import probe
+from ..run import Result, execute, run
+from ..trash import Trash
+from ..userdirs import log_dir
 
 valids = set(string.digits + '.')
 
 
-def update_symlinks(*, remove_symlinks: bool = False, verbose: bool = False) -> None:
-    "Update all symlinks in pyenv versions dir"
-    basestr = run('pyenv root', capture=True)
-    if not basestr:
-        return None
+@dataclass
+class Inventory:
+    "Installed pyenv versions, read directly from the pyenv versions dir"
 
-    base = Path(basestr.strip()) / 'versions'
-    if not base.exists():
+    base: Path
+    installs: dict[str, version.Version] = field(default_factory=dict)
+    links: dict[str, str] = field(default_factory=dict)
+    others: list[str] = field(default_factory=list)
+
+    def add(self, name: str) -> None:
+        "Add given installed version, keeping installs sorted"
+        self.installs[name] = version.parse(name)
+        self.installs = dict(sorted(self.installs.items(), key=lambda x: x[1]))
+
+    def remove(self, name: str) -> None:
+        "Remove given installed version"
+        self.installs.pop(name, None)
+
+
+def get_inventory() -> Inventory | None:
+    "Scan pyenv versions dir and return inventory of installed versions"
+    root = os.getenv('PYENV_ROOT') or probe(['pyenv', 'root'], env=['PYENV_ROOT'])
+    if not root:
         return None
 
-    # Record of all the existing symlinks and version dirs
-    oldlinks = {}
-    vers = []
-    for path in base.iterdir():
-        if all(c in valids for c in path.name):
+    inv = Inventory(Path(root.strip()) / 'versions')
+    if not inv.base.is_dir():
+        return inv
+
+    installs = {}
+    for path in inv.base.iterdir():
+        name = path.name
+        if name.startswith('.'):
+            continue
+
+        if all(c in valids for c in name):
             if path.is_symlink():
-                if remove_symlinks:
-                    if verbose:
-                        print(f'Removing link {path}')
-                    path.unlink()
-                else:
-                    oldlinks[path.name] = os.readlink(str(path))
+                inv.links[name] = os.readlink(path)
+                continue
+            try:
+                installs[name] = version.parse(name)
+            except version.InvalidVersion:
+                pass
             else:
-                vers.append(path)
+                continue
+
+        inv.others.append(name)
+
+    inv.installs = dict(sorted(installs.items(), key=lambda x: x[1]))
+    inv.others.sort()
+    return inv
+
+
+def update_symlinks(
+    inv: Inventory, *, remove_symlinks: bool = False, verbose: bool = False
+) -> None:
+    "Update all symlinks in pyenv versions dir"
+    base = inv.base
+    if not base.exists():
+        return None
 
     if remove_symlinks:
+        for name in inv.links:
+            path = base / name
+            if verbose:
+                print(f'Removing link {path}')
+            path.unlink()
+
+        inv.links.clear()
         return None
 
-    # Create a map of all the new major version links
-    newlinks_all = defaultdict(list)
-    for path in vers:
-        namevers = path.name
+    # Create a map of all the new major version links. Installs are
+    # sorted so the last version seen for each major is the latest.
+    newlinks = {}
+    for namevers in inv.installs:
         while '.' in namevers[:-1]:
             namevers_major = namevers.rsplit('.', maxsplit=1)[0]
-            newlinks_all[namevers_major].append(namevers)
+            newlinks[namevers_major] = namevers
             namevers = namevers_major
 
-    newlinks = {k: sorted(v, key=version.parse)[-1] for k, v in newlinks_all.items()}
-
     # Remove all old or invalid existing links
-    for name, tgt in oldlinks.items():
+    for name, tgt in inv.links.items():
         new_tgt = newlinks.get(name)
         if not new_tgt or new_tgt != tgt:
-            path = Path(base / name)
+            path = base / name
             path.unlink()
             if verbose:
                 print(f'Removing old link {path}')
 
     # Create all needed new links
     for name, tgt in newlinks.items():
-        old_tgt = oldlinks.get(name)
+        old_tgt = inv.links.get(name)
         if not old_tgt or old_tgt != tgt:
-            path = Path(base / name)
+            path = base / name
             if verbose:
                 print(f'Adding new link {path} -> {tgt}')
             path.symlink_to(tgt, target_is_directory=True)
 
+    inv.links = newlinks
+
+
+def get_latest(majors: set[str]) -> dict[str, str] | None:
+    "Return map of latest known version for each of the given major versions"
+    # Fetch the list of all known versions just once and work out the
+    # latest for each major version ourself, rather than running
+    # "pyenv latest" for each.
+    vstr = run(['pyenv', 'install', '--list'], capture=True)
+    if not vstr:
+        return None
+
+    known = defaultdict(list)
+    for ln in vstr.splitlines():
+        vers = ln.strip()
+        if vers and all(c in valids for c in vers) and '.' in vers:
+            known[vers.rsplit('.', maxsplit=1)[0]].append(vers)
+
+    return {m: max(known[m], key=version.parse) for m in majors if m in known}
+
+
+def install(versions: list[str], jobs: int) -> list[str]:
+    "Build given versions concurrently, return list of those that failed"
+    logdir = log_dir()
+    logdir.mkdir(parents=True, exist_ok=True)
+    jobs = max(min(jobs, len(versions)), 1)
+
+    # Share the CPUs between concurrent builds unless user has set this
+    if jobs > 1 and 'MAKE_OPTS' not in os.environ:
+        os.environ['MAKE_OPTS'] = f'-j{max((os.cpu_count() or 1) // jobs, 1)}'
+
+    def build(newv: str) -> Result:
+        log = logdir / f'pyenv-install-{newv}.log'
+        print(f'### {newv}: installing, log is {log} ...', flush=True)
+        res = execute(['pyenv', 'install', '-s', newv], log=log)
+        status = 'installed' if res.ok else 'FAILED'
+        print(f'### {newv}: {status} after {res.elapsed:.0f} secs', flush=True)
+        return res
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(build, versions))
+
+    failed = [res.args[-1] for res in results if not res.ok]
+    if len(versions) > 1:
+        print(f'### {len(versions) - len(failed)} of {len(versions)} installed')
+
+    return failed
+
 
 def init(parser: ArgumentParser) -> None:
     "Called to add this command's arguments to parser at init"
@@ -88,6 +182,13 @@ def init(parser: ArgumentParser) -> None:
         action='store_true',
         help='just purge old versions if later is installed',
     )
+    parser.add_argument(
+        '-D',
+        '--detach',
+        action='store_true',
+        help='do not wait for purged versions to be deleted, '
+        'delete them in a detached background process',
+    )
     parser.add_argument(
         '-m',
         '--remove-major-symlinks',
@@ -98,27 +199,38 @@ def init(parser: ArgumentParser) -> None:
 
 def main(args: Namespace) -> str | None:
     "Called to action this command"
-    vstr = run('pyenv versions', capture=True)
-    if not vstr:
+    inv = get_inventory()
+    if not inv:
         return None
-    versions = [
-        ln.strip() for ln in vstr.splitlines() if ' system' not in ln and '->' not in ln
-    ]
-    outdates = []
-    updates = []
-    latest = None
-    for vers in versions:
+
+    for name in inv.others:
+        print(f'Skipping {name}')
+
+    majors = {}
+    for vers in inv.installs:
         verstr = vers.rsplit('.', maxsplit=1)
         major, minor = verstr if len(verstr) >= 2 else (verstr[0], '')
         if not minor.isdigit():
             print(f'Skipping {vers}')
             continue
 
-        latest = run(f'pyenv latest -k {major}', capture=True)
+        majors[vers] = major
 
-        if vers == latest:
+    latests = get_latest(set(majors.values()))
+    if latests is None:
+        return None
+
+    outdates = []
+    updates = []
+    failed = []
+    trash = None
+    for vers, major in majors.items():
+        latest = latests.get(major)
+        if not latest:
+            print(f'### {vers} has no known versions')
+        elif vers == latest:
             print(f'### {vers} up to date')
-        elif latest in versions:
+        elif latest in inv.installs:
             print(f'### {vers} -> {latest}')
             outdates.append(vers)
         else:
@@ -128,15 +240,33 @@ def main(args: Namespace) -> str | None:
 
     if not args.list:
         if args.purge:
+            # Move outdated versions aside first so the layout is consistent
+            # immediately, and delete them in the background
+            trash = Trash(jobs=args.jobs, detach=args.detach)
+            trash.cleanup(inv.base)
             for overs in outdates:
                 print(f'### {overs}: purging ...')
-                run(f'pyenv uninstall -f {overs}')
-        else:
+                trash.move(inv.base / overs)
+                inv.remove(overs)
+        elif updates:
+            failed = install(updates, args.jobs)
             for newv in updates:
-                print(f'### {newv}: installing ...')
-                run(f'pyenv install -s {newv}')
+                if newv not in failed:
+                    inv.add(newv)
 
     # Ensure we always update all the major version symlinks
     if not args.list:
-        update_symlinks(remove_symlinks=args.remove_major_symlinks, verbose=True)
+        update_symlinks(inv, remove_symlinks=args.remove_major_symlinks, verbose=True)
+
+    if trash:
+        if outdates:
+            run(['pyenv', 'rehash'])
+
+        if not args.detach:
+            print('### Waiting for purged versions to be deleted ...')
+        trash.finish()
+
+    if failed:
+        return f'Error: failed to install {", ".join(failed)}, see logs in {log_dir()}'
+
     return None
@@ -24,11 +24,38 @@ Template strings are specified in .service and .timer files by wrapping
 them in hash symbols. Installed copies of these source files have all
 instances of template strings replaced by their value. E.g. #HOME#
 gets replaced by the user's home directory path.
+
+Extra template strings can be specified as NAME=VALUE lines in a file
+given with the --env-file option. Any #NAME# which is not a known
+template string is reported, and is left unchanged.
+
+A record is kept of each installed unit file with its source file and
+the template values used, so a service whose unit files have not
+changed since it was installed is not rewritten, re-enabled, or
+restarted. A service which was not yet enabled or started since it was
+installed (e.g. due to --no-enable, --no-start, or a failure) is still
+enabled or started. Use --force to install, enable, and restart all services
+regardless.
+
+All changes are first planned as the invoking user, then applied in a
+single step. For system services, only that apply step is run as root,
+via sudo. Use --plan to just show the planned changes with diffs.
+
+Changed services (or their timers) are restarted concurrently, up to
+the global --jobs limit at once. Each is then waited on until it is
+active (or its timer is scheduled), or has failed, or the --timeout
+expires. A summary of all restarted units and their startup times is
+reported, and the command fails if any unit did not start.
+
+Use --recursive (or --root) to install services from all directories
+under the current (or root) directory, all as one batch.
 """
 
 from __future__ import annotations
 
+import difflib
 import getpass
+import json
 import os
 import sys
 from argparse import ArgumentParser, Namespace
@@ -37,7 +64,27 @@ from pwd import getpwnam
 
 import platformdirs
 
+from .. import apply, index, template
+from .. import units as units_
+from ..manifest import Manifest, get_hash
 from ..run import run
+from ..userdirs import state_dir
+
+# File recording units installed, so unchanged units can be skipped
+MANIFEST = 'service-manifest.json'
+
+# Names of built-in template strings
+BUILTINS = {
+    'HOME',
+    'USER',
+    'USERID',
+    'GROUPID',
+    'WORKDIR',
+    'PROGDIR',
+    'BASENAME',
+    'PROG',
+    'PROGTITLE',
+}
 
 
 def init(parser: ArgumentParser) -> None:
@@ -57,49 +104,58 @@ def init(parser: ArgumentParser) -> None:
         action='store_true',
         help='just uninstall and remove service[s]',
     )
-    parser.add_argument('units', nargs='*', help='systemd service file[s]')
-
-
-def remove_unit(args: Namespace, unit: Path) -> bool:
-    "Remove given unit file"
-    if not unit.exists():
-        return False
-
-    unit.unlink()
-    print(f'### {unit} removed')
-
-    # Delete all empty parent dirs if user ..
-    if args.user:
-        while True:
-            unit = unit.parent
-            if any(unit.iterdir()):
-                break
-            try:
-                unit.parent.rmdir()
-            except Exception:
-                print(
-                    f'### Warning: failed to remove {unit} directory', file=sys.stderr
-                )
-            else:
-                print(f'### {unit} directory removed')
-
-    return True
-
-
-def create_unit(
-    args: Namespace, templdata: dict[str, str], sysdpath: Path, unit: Path
-) -> bool:
-    "Create given unit file"
+    parser.add_argument(
+        '-f',
+        '--force',
+        action='store_true',
+        help='install, enable and restart all service[s], even if unchanged',
+    )
+    parser.add_argument(
+        '-p',
+        '--plan',
+        action='store_true',
+        help='just show the changes that would be made, do not apply them',
+    )
+    parser.add_argument(
+        '-t',
+        '--timeout',
+        type=float,
+        default=30,
+        help='seconds to wait for each service to start, default is %(default)s',
+    )
+    parser.add_argument(
+        '-E',
+        '--env-file',
+        help='file of extra NAME=VALUE template strings to substitute',
+    )
+    units_.add_arguments(parser)
+
+
+def plan_unit(
+    args: Namespace,
+    templdata: dict[str, str],
+    sysdpath: Path,
+    unit: Path,
+    manifest: Manifest,
+    plan: dict,
+) -> tuple[bool, str | None, bool]:
+    "Add given unit file to plan, return if changed, hash if rendered, and if wanted"
     target = sysdpath / unit.name
-    print(f'### Creating unit file {target}')
-    templdata['PROG'] = unit.stem
-    templdata['PROGTITLE'] = unit.stem.upper()
-    sysdpath.parent.mkdir(exist_ok=True)
+    values = {**templdata, 'PROG': unit.stem, 'PROGTITLE': unit.stem.upper()}
+
+    # Skip rendering and checking target if nothing changed since install
+    source = unit.resolve()
+    inputs = get_hash(json.dumps([values, args.user], sort_keys=True))
+    if not args.force and manifest.unchanged(target, source, inputs):
+        print(f'### {target} has not changed')
+        return False, None, manifest.wanted(target)
 
-    # Read unit file and replace all template values
-    content = unit.read_text()
-    for key, val in templdata.items():
-        content = content.replace(f'#{key}#', val)
+    # Read unit file and replace all template values in one pass
+    content, unknowns = template.load(unit).render(values)
+    for name in sorted(unknowns):
+        print(
+            f'### Warning: unknown template string #{name}# in {unit}', file=sys.stderr
+        )
 
     # If installing as user then must remove User line
     if args.user:
@@ -107,47 +163,71 @@ def create_unit(
             ln for ln in content.splitlines() if not ln.startswith('User=')
         )
 
+    # Unit can only be enabled and started if wanted by another unit
+    chash = get_hash(content)
+    wanted = 'By=' in content
+    write = {
+        'target': str(target),
+        'source': str(source),
+        'inputs': inputs,
+        'hash': chash,
+        'wanted': wanted,
+        'content': content,
+    }
+    plan['writes'].append(write)
+
     if not target.exists():
-        print(f'### {target} has been installed')
-        target.parent.mkdir(exist_ok=True)
-        target.write_text(content)
-    elif content != target.read_text():
-        print(f'### {target} has been updated')
-        target.write_text(content)
-    else:
+        print(f'### {target} is new')
+        oldcontent = ''
+    elif manifest.installed(target, chash) or (
+        (oldcontent := target.read_text()) == content
+    ):
+        # Just need to record this target in the manifest
         print(f'### {target} has not changed')
-        return False
+        write['content'] = None
+        return False, chash, wanted
+    else:
+        print(f'### {target} has changed')
+
+    if args.plan:
+        sys.stdout.writelines(
+            difflib.unified_diff(
+                oldcontent.splitlines(keepends=True),
+                content.splitlines(keepends=True),
+                str(target),
+                str(unit),
+            )
+        )
+        print()
 
-    return True
+    return True, chash, wanted
 
 
 def main(args: Namespace) -> str | None:
     "Called to action this command"
-    userid = os.getuid()
-    if not args.user:
-        # Not user mode so if not yet running as root then re-invoke
-        # ourself as root ..
-        if userid != 0:
-            return run('sudo ' + ' '.join(sys.argv))
-
-        # Running as root from here ..
-        user = os.getenv('SUDO_USER')
-        if not user:
-            return 'Error: must run using sudo to identify user'
-
-        sysdpath = Path('/etc/systemd/system')
-    else:
+    if args.user:
         user = getpass.getuser()
         sysdpath = platformdirs.user_config_path() / 'systemd' / 'user'
+    else:
+        # If running as root then must have been invoked using sudo
+        if os.getuid() == 0:
+            user = os.getenv('SUDO_USER')
+            if not user:
+                return 'Error: must run using sudo to identify user'
+        else:
+            user = getpass.getuser()
 
-    units = (
-        [Path(p) for p in args.units]
-        if args.units
-        else list(Path.cwd().glob('*.service'))
-    )
+        sysdpath = Path('/etc/systemd/system')
+
+    units = units_.get_units(args)
+    if isinstance(units, str):
+        return units
 
-    if not units:
-        return 'There are no .service files in this directory'
+    # Units from different dirs would be installed to the same target
+    names: dict[str, Path] = {}
+    for unit in units:
+        if (other := names.setdefault(unit.name, unit)) != unit:
+            return f'Error: {unit} and {other} have the same name'
 
     pw = getpwnam(user)
 
@@ -158,49 +238,107 @@ def main(args: Namespace) -> str | None:
     templdata['GROUPID'] = str(pw.pw_gid)
     templdata['HOME'] = pw.pw_dir
 
-    sysctl = 'systemctl --user' if args.user else 'systemctl'
-    change = False
+    # Add any extra user template strings
+    if args.env_file:
+        extras = template.read_env(Path(args.env_file))
+        if isinstance(extras, str):
+            return extras
+
+        if names := BUILTINS & extras.keys():
+            return f'Error: can not redefine {", ".join(sorted(names))} in env file'
+
+        templdata.update(extras)
+
+    sysctl = ['systemctl', '--user'] if args.user else ['systemctl']
+    manfile = (state_dir() if args.user else index.SYSTEM_DIR) / MANIFEST
+    manifest = Manifest(manfile)
+
+    # Plan all changes as the invoking user, to then be applied in one
+    # step (as root for system services)
+    plan: dict = {
+        'user': args.user,
+        'sysctl': sysctl,
+        'manifest': str(manfile),
+        'index': str(index.get_path(args.user)),
+        'unitdir': str(sysdpath),
+        'username': user,
+        'disable': [],
+        'removes': [],
+        'writes': [],
+        'enable': [],
+        'restart': [],
+        'jobs': args.jobs,
+        'timeout': args.timeout,
+    }
+    enables = []
+    restarts = []
 
     # Iterate over all specified service files ..
+    project = None
     for unit in units:
-        if not unit.suffix.lower() == '.service':
-            unit = unit.with_suffix('.service')
-
-        if not unit.exists():
-            print(f'### {unit} does not exist', file=sys.stderr)
-            continue
+        if (args.recursive or args.root) and unit.parent != project:
+            project = unit.parent
+            print(f'### Project {project}:')
 
         if args.remove:
             for ext in ('.timer', '.socket', '.service'):
-                name = unit.stem + ext
-                run(f'{sysctl} disable --now {name}', capture=True, ignore_error=True)
-                if remove_unit(args, sysdpath / name):
-                    change = True
+                target = sysdpath / (unit.stem + ext)
+                if target.exists():
+                    plan['disable'].append(target.name)
+                    plan['removes'].append(str(target))
             continue
 
         workdir = unit.parent
-        templdata['WORKDIR'] = templdata['PROGDIR'] = str(workdir)
-        templdata['BASENAME'] = workdir.name
-
+        unitdata = {
+            **templdata,
+            'WORKDIR': str(workdir),
+            'PROGDIR': str(workdir),
+            'BASENAME': workdir.name,
+        }
+
+        unit_change = False
         for ext in ('.timer', '.socket'):
             other = unit.with_suffix(ext)
             if other.exists():
-                create_unit(args, templdata, sysdpath, unit)
+                unit_change, _, _ = plan_unit(
+                    args, unitdata, sysdpath, unit, manifest, plan
+                )
                 unit = other
                 break
 
-        if create_unit(args, templdata, sysdpath, unit):
-            change = True
-
-        if 'By=' in unit.read_text():
-            if not args.no_enable:
-                run(f'{sysctl} enable {unit.name}')
-
-            if not args.no_start:
-                run(f'{sysctl} restart {unit.name}')
-                run(f'{sysctl} --no-pager status {unit.name}')
-
-    if change:
-        run(f'{sysctl} daemon-reload')
-
+        change, chash, wanted = plan_unit(
+            args, unitdata, sysdpath, unit, manifest, plan
+        )
+        unit_change = unit_change or change or args.force
+
+        # Only need to enable/restart units which have changed, or which
+        # were not yet enabled/started since installed
+        if wanted:
+            target = sysdpath / unit.name
+            if unit_change or not manifest.done(target, 'enabled', chash):
+                enables.append(unit.name)
+            if unit_change or not manifest.done(target, 'started', chash):
+                restarts.append(unit.name)
+
+    if not args.no_enable:
+        plan['enable'] = enables
+
+    if not args.no_start:
+        plan['restart'] = restarts
+
+    if args.plan:
+        for key in ('disable', 'enable', 'restart'):
+            if plan[key]:
+                print(f'### Would run {" ".join(sysctl)} {key} {" ".join(plan[key])}')
+        return None
+
+    if not any(plan[k] for k in ('disable', 'removes', 'writes', 'enable', 'restart')):
+        return None
+
+    # Apply plan, using sudo to run just the apply step as root if needed
+    if args.user or os.getuid() == 0:
+        return apply.apply(plan)
+
+    # Run isolated, so modules in the current dir are never imported as root
+    run(['sudo', sys.executable, '-I', '-m', apply.__name__], input=json.dumps(plan))
     return None
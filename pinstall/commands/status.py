@@ -1,16 +1,62 @@
 #!/usr/bin/python3
 """
 Reports systemctl status of services and timers installed from the
-current directory.
+current directory, or from all directories under a root directory.
+
+The state of all units is queried at once and reported as a compact
+table, or as JSON with --json. Use --full to instead report the full
+systemctl status of each unit, including recent journal entries.
+
+Use --watch to keep reporting the table, updating just the rows of units
+whose state changes, and highlighting those changes. Units are checked
+every second while any are changing, slowing to every 10 seconds while
+none are.
 """
 
 from __future__ import annotations
 
+import json
 import sys
+import time
 from argparse import ArgumentParser, Namespace
 from pathlib import Path
 
-from ..run import run
+from .. import units as units_
+from ..run import run_all
+from ..systemd import show
+
+# Unit properties queried
+PROPS = (
+    'LoadState',
+    'ActiveState',
+    'SubState',
+    'UnitFileState',
+    'MainPID',
+    'MemoryCurrent',
+    'NextElapseUSecRealtime',
+)
+
+# Table columns, and their report keys
+COLUMNS = {
+    'UNIT': 'unit',
+    'ENABLED': 'enabled',
+    'ACTIVE': 'active',
+    'SUB': 'sub',
+    'PID': 'pid',
+    'MEMORY': 'memory',
+    'NEXT': 'next',
+}
+
+# Report keys which are state transitions, highlighted when watching
+TRANSITIONS = ('load', 'active', 'sub', 'pid', 'next')
+
+# Minimum and maximum interval between checks when watching, in seconds
+WATCH_MIN = 1.0
+WATCH_MAX = 10.0
+
+# Terminal colors to highlight changed units, by active state
+COLORS = {'active': '32', 'failed': '31'}
+COLOR_OTHER = '33'
 
 
 def init(parser: ArgumentParser) -> None:
@@ -18,36 +64,199 @@ def init(parser: ArgumentParser) -> None:
     parser.add_argument(
         '-u', '--user', action='store_true', help='report for user service'
     )
-    parser.add_argument('units', nargs='*', help='systemd service file[s]')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-J', '--json', action='store_true', help='report as JSON')
+    group.add_argument(
+        '-f',
+        '--full',
+        action='store_true',
+        help='report full systemctl status of each unit',
+    )
+    group.add_argument(
+        '-w',
+        '--watch',
+        action='store_true',
+        help='keep watching and reporting changes in state, until interrupted',
+    )
+    units_.add_arguments(parser)
+
+
+def get_report(state: dict[str, str], unit: str, project: str | None) -> dict:
+    "Return report of given unit from its systemctl properties"
+    pid = int(state.get('MainPID') or 0)
+    memory = state.get('MemoryCurrent', '')
+
+    # Memory is reported as unset, or as max int if not accounted
+    memory = int(memory) if memory.isdigit() and int(memory) < 2**64 - 1 else None
+
+    report = {} if project is None else {'project': project}
+    return {
+        **report,
+        'unit': unit,
+        'load': state.get('LoadState') or None,
+        'enabled': state.get('UnitFileState') or None,
+        'active': state.get('ActiveState') or None,
+        'sub': state.get('SubState') or None,
+        'pid': pid or None,
+        'memory': memory,
+        'next': state.get('NextElapseUSecRealtime') or None,
+    }
+
+
+def fmt_bytes(num: int) -> str:
+    "Return given number of bytes in human readable form, like systemctl"
+    val = float(num)
+    for unit in ('B', 'K', 'M', 'G', 'T'):
+        if val < 1024 or unit == 'T':
+            break
+        val /= 1024
+
+    return f'{val:.0f}{unit}' if unit == 'B' else f'{val:.1f}{unit}'
+
+
+def fmt_table(reports: list[dict], widths: list[int] | None = None) -> list[str]:
+    "Return lines of table of given reports, growing given column widths to fit"
+    # Add project column, if reporting units from multiple projects
+    columns = COLUMNS
+    if reports and 'project' in reports[0]:
+        columns = {'PROJECT': 'project', **COLUMNS}
+
+    rows = [list(columns)]
+    project = None
+    for report in reports:
+        row = []
+        for key in columns.values():
+            val = report[key]
+            if key == 'project':
+                # Only show project for first of its units
+                val, project = ('' if val == project else val), val
+            elif val is None:
+                val = '-'
+            elif key == 'memory':
+                val = fmt_bytes(val)
+            elif key == 'active' and report['load'] != 'loaded':
+                val = report['load']
+            row.append(str(val))
+        rows.append(row)
+
+    if widths is None:
+        widths = []
+
+    widths[:] = [
+        max(w, *(len(r[i]) for r in rows))
+        for i, w in enumerate(widths or [0] * len(columns))
+    ]
+    return ['  '.join(v.ljust(w) for v, w in zip(row, widths)).rstrip() for row in rows]
+
+
+def watch(sysctl: list[str], names: list[str], projects: list[str | None]) -> None:
+    "Watch state of given units, redrawing changed rows until interrupted"
+    tty = sys.stdout.isatty()
+    interval = WATCH_MIN
+    prev: list[dict] = []
+    lines: list[str] = []
+    marked: set[int] = set()
+
+    # Columns widths only grow, to avoid redrawing all rows when they shrink
+    widths: list[int] = []
+
+    while True:
+        states = show(sysctl, names, PROPS)
+        reports = [get_report(*item) for item in zip(states, names, projects)]
+        changed = {
+            i
+            for i, report in enumerate(reports)
+            if prev and any(report[k] != prev[i][k] for k in TRANSITIONS)
+        }
+        newlines = fmt_table(reports, widths)
+        stamp = time.strftime('%H:%M:%S')
+
+        # Check faster while units are changing
+        interval = WATCH_MIN if changed else min(interval * 1.5, WATCH_MAX)
+
+        if not tty:
+            # Not a terminal, so just output rows which have changed
+            if not prev:
+                print('\n'.join(newlines))
+            for i in sorted(changed):
+                print(f'{newlines[i + 1]}  [{stamp}]')
+        else:
+            newlines.append(f'Checked at {stamp}, press Ctrl-C to quit')
+            out = []
+            if not prev or newlines[0] != lines[0]:
+                # First time, or column widths have changed, so redraw all
+                if lines:
+                    out.append(f'\x1b[{len(lines)}F\x1b[J')
+                redraw = set(range(len(newlines)))
+            else:
+                # Redraw changed rows, plus those highlighted last time
+                redraw = {len(lines) - 1} | {i + 1 for i in changed | marked}
+                redraw |= {i for i, ln in enumerate(newlines) if ln != lines[i]}
+
+            for i in sorted(redraw):
+                line = newlines[i]
+                if i - 1 in changed:
+                    color = COLORS.get(reports[i - 1]['active'], COLOR_OTHER)
+                    line = f'\x1b[1;{color}m{line}\x1b[0m'
+
+                if prev and newlines[0] == lines[0]:
+                    up = len(lines) - i
+                    out.append(f'\x1b[{up}F\x1b[2K{line}\x1b[{up}E')
+                else:
+                    out.append(f'{line}\n')
+
+            sys.stdout.write(''.join(out))
+            marked = changed
+
+        sys.stdout.flush()
+        prev = reports
+        lines = newlines
+        time.sleep(interval)
 
 
 def main(args: Namespace) -> str | None:
     "Called to action this command"
-    units = (
-        [Path(p) for p in args.units]
-        if args.units
-        else list(Path.cwd().glob('*.service'))
-    )
-
-    if not units:
-        return 'There are no .service files in this directory'
+    units = units_.get_units(args)
+    if isinstance(units, str):
+        return units
 
-    cmd = 'systemctl --user status' if args.user else 'systemctl status'
+    sysctl = ['systemctl', '--user'] if args.user else ['systemctl']
+    root = Path(args.root or '.').resolve()
+    recursive = args.recursive or bool(args.root)
 
     # Iterate over all specified service files ..
+    names = []
+    projects: list[str | None] = []
     for unit in units:
-        if not unit.suffix.lower() == '.service':
-            unit = unit.with_suffix('.service')
-
-        if not unit.exists():
-            print(f'### {unit} does not exist', file=sys.stderr)
-            continue
-
+        project = str(unit.parent.relative_to(root)) if recursive else None
         for ext in ('.timer', '.socket'):
             other = unit.with_suffix(ext)
             if other.exists():
-                run(f'{cmd} {other.name}')
+                names.append(other.name)
+                projects.append(project)
+
+        names.append(unit.name)
+        projects.append(project)
+
+    if args.full:
+        cmds = [[*sysctl, 'status', name] for name in names]
+        run_all(cmds, jobs=args.jobs)
+        return None
+
+    if args.watch:
+        try:
+            watch(sysctl, names, projects)
+        except KeyboardInterrupt:
+            print()
+        return None
+
+    # Query state of all units in one call
+    states = show(sysctl, names, PROPS)
+    reports = [get_report(*item) for item in zip(states, names, projects)]
 
-        run(f'{cmd} {unit.name}')
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        print('\n'.join(fmt_table(reports)))
 
     return None
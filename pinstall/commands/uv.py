@@ -14,6 +14,7 @@ import os
 from argparse import ArgumentParser, Namespace
 from pathlib import Path
 
+from ..probe import probe
 from ..run import run
 
 URL = 'https://astral.sh/uv/install.sh'
@@ -22,7 +23,7 @@ URL = 'https://astral.sh/uv/install.sh'
 def get_ver(uv: Path) -> str | None:
     "Run the specified uv to return the version"
     if uv.is_file():
-        out = run(f'{uv} --version', capture=True)
+        out = probe([uv, '--version'])
         return out.split()[1] if out else None
 
     return None
@@ -82,7 +83,11 @@ def main(args: Namespace) -> str | None:
 
     os.environ['UV_INSTALL_DIR'] = str(bindir)
     os.environ['UV_NO_MODIFY_PATH'] = '1'
-    run(f'curl -LsSf "{URL}" | sh -s -- -q')
+    script = run(['curl', '-LsSf', URL], capture=True)
+    if not script:
+        return f'Failed to download {URL}'
+
+    run(['sh', '-s', '--', '-q'], input=script)
 
     ver = get_ver(uv)
     if not ver:
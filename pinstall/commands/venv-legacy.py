@@ -4,25 +4,51 @@ Creates a Python virtual environment using legacy venv + pip.
 
 Runs `python -m venv` to create a `.venv/` (optionally for the specified
 Python name, or path); adds a .gitignore to it to be automatically
-ignored by git; upgrades the venv with the latest pip + setuptools +
-wheel; then installs all package dependencies from 1) requirements.txt
-if present, or 2) from pyproject.toml if present.
+ignored by git; then, in a single pip install, upgrades the venv with
+the latest pip + setuptools + wheel and installs all package
+dependencies from 1) requirements.txt if present, or 2) from
+pyproject.toml if present, plus any extra packages.
+
+Requirements are first pinned in a lockfile next to the requirements
+file (e.g. requirements.lock for requirements.txt, or pyproject.lock for
+pyproject.toml dependencies) from a `pip install --dry-run` report, and
+then installed straight from those pins. The lockfile is only pinned
+again when the requirements (or the Python minor version or platform)
+change, so all hosts on the same platform install the same versions.
+Requirements with editable, local, or nested requirements are not
+pinned. Use --no-lock to not use a lockfile.
+
+Use --sync to keep an existing venv if it uses the same Python
+interpreter and version, and just install the requirements into it
+again, so only changed packages are installed (pip can not remove
+packages no longer required). A fingerprint of all inputs is kept in the
+venv, so if nothing has changed since then there is nothing to do.
+
+Any existing venv is first moved aside, then deleted in the background
+while the new venv is created. Use --detach to not wait for it to be
+deleted, e.g. to just remove a large venv quickly with --remove.
 """
 
 from __future__ import annotations
 
-import shutil
+import sys
 from argparse import ArgumentParser, Namespace
 from pathlib import Path
 
+from .. import index, venvsync
 from ..getpy import getpy
-from ..pyproj import get_requirements
+from ..lockfile import Lockfile, pins_from_report
+from ..pyproj import get_requirements, get_source
 from ..run import run
+from ..trash import Trash
 
 DEFDIR = '.venv'
 DEFEXE = 'python3'
 DEFREQ = 'requirements.txt'
 
+# Pip arguments to report all packages to install, without installing them
+PINARGS = ['install', '-q', '--dry-run', '--ignore-installed', '--report', '-']
+
 
 def init(parser: ArgumentParser) -> None:
     "Called to add this command's arguments to parser at init"
@@ -58,6 +84,18 @@ def init(parser: ArgumentParser) -> None:
         metavar='PACKAGE',
         help='also install (1 or more) given packages',
     )
+    parser.add_argument(
+        '-L',
+        '--no-lock',
+        action='store_true',
+        help='install requirements directly, without pinning them in a lockfile',
+    )
+    parser.add_argument(
+        '-s',
+        '--sync',
+        action='store_true',
+        help='update existing venv with requirements, instead of rebuilding it',
+    )
     parser.add_argument(
         '-w',
         '--without-pip',
@@ -74,6 +112,13 @@ def init(parser: ArgumentParser) -> None:
         action='store_true',
         help='just remove any existing venv and finish',
     )
+    parser.add_argument(
+        '-D',
+        '--detach',
+        action='store_true',
+        help='do not wait for any existing venv to be deleted, '
+        'delete it in a detached background process',
+    )
     parser.add_argument(
         '-v',
         '--verbose',
@@ -90,60 +135,127 @@ def init(parser: ArgumentParser) -> None:
     )
 
 
-def main(args: Namespace) -> str | None:
-    "Called to action this command"
+def create(args: Namespace, trash: Trash) -> str | None:
+    "Create (or just remove) venv, moving any existing venv to given trash"
     pyexe = getpy(args.python)
     vdir = Path(args.dir)
 
     if args.remove:
         if vdir.is_dir():
             print(f'Removing {vdir}/ ..')
-            shutil.rmtree(vdir)
+            trash.move(vdir)
+            index.remove_venv(vdir)
             return None
         return f'{vdir}/ does not exist'
 
-    if '--upgrade' not in args.args and vdir.exists():
-        print(f'### Removing existing {vdir}/ ..')
-        shutil.rmtree(vdir)
-
     if args.without_pip and '--without-pip' not in args.args:
         args.args.append('--without-pip')
 
-    # Create the venv ..
-    opts = ' ' + ' '.join(args.args)
-    run(f'{pyexe} -m venv{opts.rstrip()} {vdir}')
-    if not vdir.exists():
-        return None
+    withpip = '--without-pip' not in args.args
+    reqfile = None
+    reqs = ''
+    if withpip and not args.no_require:
+        reqfile = get_requirements(args.requirements_file, DEFREQ)
+        if isinstance(reqfile, str):
+            return reqfile
+        if reqfile:
+            reqs = reqfile.read_text()
 
-    # Python 3.13+ may create a .gitignore for us, but if not, create one ..
-    gitignore = vdir / '.gitignore'
-    if not gitignore.exists():
-        gitignore.write_text(f'# Automatically created by {args._prog}\n*\n')
+    python = venvsync.get_python(pyexe)
+
+    # Pin requirements in a lockfile, unless they depend on local files
+    lock = None
+    if reqfile and python and not args.no_lock and not venvsync.LOCALREQ.search(reqs):
+        lock = Lockfile(get_source(reqfile), reqs, python)
+
+    # Fingerprint all inputs, to check if venv is current
+    inputs = python and [*python, args.args, [args.no_upgrade, args.no_wheel]]
+    fingerprint = inputs and venvsync.get_fingerprint(
+        inputs, (lock and lock.pins) or reqs, args.install
+    )
+
+    syncing = args.sync and python and venvsync.matches(vdir, python)
+    if syncing:
+        if venvsync.is_current(vdir, fingerprint):
+            print(f'### {vdir}/ is up to date')
+            return None
+
+        print(f'### Syncing existing {vdir}/ ..')
+    else:
+        if '--upgrade' not in args.args and vdir.exists():
+            print(f'### Removing existing {vdir}/ ..')
+            trash.move(vdir)
+
+        # Create the venv ..
+        run([pyexe, '-m', 'venv', *args.args, vdir])
+        if not vdir.exists():
+            return None
+
+        # Python 3.13+ may create a .gitignore for us, but if not, create one ..
+        gitignore = vdir / '.gitignore'
+        if not gitignore.exists():
+            gitignore.write_text(f'# Automatically created by {args._prog}\n*\n')
 
     # Next do all pip installs ..
-    if '--without-pip' in args.args:
-        return None
+    if withpip:
+        pip = [str(vdir / 'bin/pip')]
+        if args.verbose > 0:
+            pip.append('-' + 'v' * args.verbose)
 
-    pip = str(vdir / 'bin/pip')
-    if args.verbose > 0:
-        pip += ' -' + 'v' * args.verbose
+        if lock and lock.pins is None:
+            print(f'### Pinning requirements in {lock.path} ..')
+            report = run([pip[0], *PINARGS, '-r', reqfile], capture=True)
+            pins = pins_from_report(report)
+            if pins is None:
+                # E.g. older pip versions can not report
+                print(
+                    f'### Warning: failed to pin requirements from {reqfile}',
+                    file=sys.stderr,
+                )
+                lock = None
+            else:
+                lock.write(pins)
+                fingerprint = inputs and venvsync.get_fingerprint(
+                    inputs, lock.pins, args.install
+                )
 
-    if not args.no_upgrade and '--upgrade-deps' not in args.args:
-        run(f'{pip} --disable-pip-version-check install -U pip')
-        run(f'{pip} install -U setuptools')
+        # Build one set of bootstrap tools, requirements, and extra
+        # packages to resolve and install all together
+        pkgs = []
+        if not syncing:
+            if not args.no_upgrade and '--upgrade-deps' not in args.args:
+                pkgs.extend(['pip', 'setuptools'])
 
-    if not args.no_wheel:
-        run(f'{pip} install -U wheel')
+            if not args.no_wheel:
+                pkgs.append('wheel')
 
-    if not args.no_require:
-        reqfile = get_requirements(args.requirements_file, DEFREQ)
-        if reqfile:
-            if isinstance(reqfile, str):
-                return reqfile
-            run(f'{pip} install -U -r "{reqfile}"')
+        pkgs.extend(args.install or [])
+
+        # Install straight from the pins, without resolving again unless
+        # other packages also need to be resolved with them
+        reqargs: list[str | Path] = []
+        if lock:
+            reqargs = ['-r', lock.path] if pkgs else ['--no-deps', '-r', lock.path]
+        elif reqfile:
+            reqargs = ['-r', reqfile]
+
+        if reqargs or pkgs:
+            run([*pip, '--disable-pip-version-check', 'install', '-U', *reqargs, *pkgs])
 
-    if args.install:
-        pkgs = ' '.join(args.install)
-        run(f'{pip} install -U {pkgs}')
+    venvsync.save(vdir, fingerprint)
 
+    # Record venv in the host index of installs
+    index.record_venv(vdir, [str(pyexe), args.args, reqs, args.install])
     return None
+
+
+def main(args: Namespace) -> str | None:
+    "Called to action this command"
+    # Any existing venv is moved aside, then deleted in the background
+    # while the new venv is created
+    trash = Trash(jobs=args.jobs, detach=args.detach)
+    trash.cleanup(Path(args.dir).absolute().parent)
+    try:
+        return create(args, trash)
+    finally:
+        trash.finish()
@@ -4,30 +4,81 @@ Creates a Python virtual environment using uv.
 
 Runs `uv venv` to create a `.venv/` (optionally for the specified Python
 name, or path) then installs all package dependencies from 1)
-requirements.txt if present, or 2) from pyproject.toml if present.
+requirements.txt if present, or 2) from pyproject.toml if present, plus
+any extra packages, all resolved and installed together.
 
 [uv](https://github.com/astral-sh/uv) is a new Python installation tool
 which is more efficient and **much** faster than `python -m venv` and
 `pip`. You can use the `venv` command pretty much in place of `venv-legacy`
 and it will work similarly.
+
+Each venv is built in a cache, keyed by the Python interpreter and its
+version, the uv version and arguments, and the exact versions of all
+packages (as pinned in the lockfile, else as resolved from the
+requirements and any extra packages). The venv is then cloned from
+there (by reflink where the file system supports it, else by hardlink,
+else by copying), so creating the same venv again does not need to
+install anything. Venvs with editable, local, or nested requirements
+are not cached. Use --no-cache to not use the cache.
+
+Requirements are first pinned in a lockfile next to the requirements
+file (e.g. requirements.lock for requirements.txt, or pyproject.lock for
+pyproject.toml dependencies) using `uv pip compile`, and then installed
+straight from those pins. The lockfile is only pinned again when the
+requirements (or the Python minor version or platform) change, so
+repeat runs do not need to resolve dependencies, and all hosts on the
+same platform install the same versions.
+Requirements with editable, local, or nested requirements are not
+pinned. Use --no-lock to not use a lockfile.
+
+Use --sync to keep an existing venv if it uses the same Python
+interpreter and version, and sync its packages to the requirements
+instead, so only changed packages are installed or removed. A
+fingerprint of all inputs is kept in the venv, so if nothing has changed
+since then there is nothing to do.
+
+Any existing venv is first moved aside, then deleted in the background
+while the new venv is created. Use --detach to not wait for it to be
+deleted, e.g. to just remove a large venv quickly with --remove.
 """
 
 from __future__ import annotations
 
+import json
+import os
 import shutil
 import sys
+import tempfile
+import time
 from argparse import ArgumentParser, Namespace
 from pathlib import Path
 
+from .. import index, venvsync
+from ..clone import Cloner
 from ..getpy import getpy
-from ..pyproj import get_requirements
+from ..lockfile import Lockfile
+from ..manifest import get_hash
+from ..probe import probe
+from ..pyproj import get_requirements, get_source
 from ..run import run
+from ..trash import Trash
+from ..userdirs import NAME, cache_dir
 
 DEFDIR = '.venv'
 DEFEXE = 'python3'
 DEFUV = 'uv'
 DEFREQ = 'requirements.txt'
 
+# Cache dir of built venvs, and time to keep them unused, in seconds
+CACHEDIR = 'venvs'
+CACHE_TTL = 30 * 24 * 60 * 60
+
+# File in cached venv recording the path it was built at
+BUILDFILE = f'.{NAME}-build'
+
+# Venv dirs of scripts, which contain the venv path
+BINDIRS = ('bin', 'Scripts')
+
 
 def init(parser: ArgumentParser) -> None:
     "Called to add this command's arguments to parser at init"
@@ -62,12 +113,37 @@ def init(parser: ArgumentParser) -> None:
         metavar='PACKAGE',
         help='also install (1 or more) given packages',
     )
+    parser.add_argument(
+        '-L',
+        '--no-lock',
+        action='store_true',
+        help='install requirements directly, without pinning them in a lockfile',
+    )
+    parser.add_argument(
+        '-s',
+        '--sync',
+        action='store_true',
+        help='sync existing venv with requirements, instead of rebuilding it',
+    )
+    parser.add_argument(
+        '-n',
+        '--no-cache',
+        action='store_true',
+        help='build venv directly, without using the venv cache',
+    )
     parser.add_argument(
         '-R',
         '--remove',
         action='store_true',
         help='just remove any existing venv and finish',
     )
+    parser.add_argument(
+        '-D',
+        '--detach',
+        action='store_true',
+        help='do not wait for any existing venv to be deleted, '
+        'delete it in a detached background process',
+    )
     parser.add_argument(
         'args',
         nargs='*',
@@ -77,10 +153,143 @@ def init(parser: ArgumentParser) -> None:
     )
 
 
-def main(args: Namespace) -> str | None:
-    "Called to action this command"
+def build(
+    uv: str,
+    pyexe: str,
+    uvargs: list[str],
+    vdir: Path,
+    reqargs: list[str | Path],
+    install: list[str] | None,
+) -> bool:
+    "Build venv at given dir, return False if it was not created"
+    run([uv, 'venv', '-p', pyexe, *uvargs, vdir])
+    if not vdir.exists():
+        return False
+
+    # Resolve and install requirements and extra packages all together
+    vdir = vdir.resolve()
+    if reqargs or install:
+        run([uv, 'pip', 'install', '-p', vdir, *reqargs, *(install or [])])
+
+    return True
+
+
+def compile_pins(uv: str, pypath: str, reqfiles: list[Path]) -> str | None:
+    "Return pins of all packages resolved from given requirements files"
+    # Annotations can include temporary file paths, so leave them out to
+    # make pins the same every time
+    args = ['-q', '--no-header', '--no-annotate', '-p', pypath, *reqfiles]
+    return run([uv, 'pip', 'compile', *args], capture=True)
+
+
+def get_python(uv: str, pyexe: str) -> tuple[str, str] | None:
+    "Return real path and full version of python uv will use, if found"
+    pypath = run([uv, 'python', 'find', pyexe], capture=True, ignore_error=True)
+    return venvsync.get_python(pypath) if pypath else None
+
+
+def sync(uv: str, vdir: Path, reqfile: Path | None, args: Namespace) -> None:
+    "Sync packages in existing venv to exactly those now required"
+    reqfiles = [reqfile] if reqfile else []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Keep pip if venv was seeded with it
+        extras = [*(args.install or []), *(['pip'] if '--seed' in args.args else [])]
+        if extras:
+            extrafile = Path(tmpdir, 'extras.in')
+            extrafile.write_text('\n'.join(extras) + '\n')
+            reqfiles.append(extrafile)
+
+        if not reqfiles:
+            return
+
+        # Sync only installs exactly what is given, so first resolve
+        # all dependencies
+        locked = Path(tmpdir, 'requirements.txt')
+        run([uv, 'pip', 'compile', '-q', '-p', vdir, '-o', locked, *reqfiles])
+        run([uv, 'pip', 'sync', '-p', vdir, locked])
+
+
+def prune(cachedir: Path) -> None:
+    "Remove cached venvs not used recently"
+    cutoff = time.time() - CACHE_TTL
+    for entry in cachedir.iterdir():
+        if entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+def relocate(vdir: Path, oldpath: str) -> None:
+    "Replace path venv was built at with its new path, in all its scripts"
+    old, new = oldpath.encode(), str(vdir).encode()
+    for bindir in BINDIRS:
+        bindir = vdir / bindir
+        if not bindir.is_dir():
+            continue
+
+        for path in bindir.iterdir():
+            if path.is_file() and not path.is_symlink():
+                data = path.read_bytes()
+                if old in data:
+                    path.write_bytes(data.replace(old, new))
+
+
+def from_cache(
+    key: str,
+    uv: str,
+    pyexe: str,
+    args: Namespace,
+    vdir: Path,
+    reqargs: list[str | Path],
+) -> bool:
+    "Create venv by cloning it from the cache, building it there if needed"
+    cachedir = cache_dir() / CACHEDIR
+    entry = cachedir / key
+    if entry.is_dir():
+        print(f'### Using cached venv {key[:12]}')
+        os.utime(entry)
+    else:
+        cachedir.mkdir(parents=True, exist_ok=True)
+        prune(cachedir)
+
+        # Prompt would otherwise be set from the cache dir name
+        uvargs = args.args
+        if not any(a.startswith('--prompt') for a in uvargs):
+            uvargs = [*uvargs, '--prompt', vdir.name]
+
+        # Build in temporary dir, then move into place in one step
+        builddir = cachedir / f'{key}.{os.getpid()}'
+        try:
+            if not build(uv, pyexe, uvargs, builddir, reqargs, None):
+                return False
+
+            (builddir / BUILDFILE).write_text(str(builddir))
+            try:
+                builddir.rename(entry)
+            except OSError:
+                # Another process has built this same venv
+                pass
+        finally:
+            if builddir.exists():
+                shutil.rmtree(builddir)
+
+    # Only link files not in the venv base or script dirs, as those are
+    # small and may be modified in place
+    vdir = vdir.absolute()
+    copydirs = {entry, *(entry / d for d in BINDIRS)}
+    cloner = Cloner()
+    cloner.clone_tree(entry, vdir, copy=lambda p: p.parent in copydirs)
+    print(f'### Cloned {vdir}/ from cache by {cloner.method}')
+
+    buildfile = vdir / BUILDFILE
+    relocate(vdir, buildfile.read_text())
+    buildfile.unlink()
+    return True
+
+
+def create(args: Namespace, trash: Trash) -> str | None:
+    "Create (or just remove) venv, moving any existing venv to given trash"
     if args.pystand_python:
-        if not (pyexe := run(f'pystand path {args.pystand_python}', capture=True)):
+        pyexe = probe(['pystand', 'path', args.pystand_python], check=os.path.exists)
+        if not pyexe:
             sys.exit(1)
     else:
         pyexe = getpy(args.python)
@@ -90,13 +299,14 @@ def main(args: Namespace) -> str | None:
     if args.remove:
         if vdir.is_dir():
             print(f'Removing {vdir}/ ..')
-            shutil.rmtree(vdir)
+            trash.move(vdir)
+            index.remove_venv(vdir)
             return None
         return f'{vdir}/ does not exist'
 
     # Ensure uv is installed/available
     uv = args.uv or DEFUV
-    version = run(f'{uv} --version', capture=True, ignore_error=True)
+    version = probe([uv, '--version'], ignore_error=True)
     if not version:
         if args.uv:
             return f'Error: uv program not found at "{uv}"'
@@ -106,26 +316,94 @@ def main(args: Namespace) -> str | None:
             'or specified with --uv option.'
         )
 
-    if vdir.exists():
-        print(f'### Removing existing {vdir}/ ..')
-        shutil.rmtree(vdir)
-
-    # Create the venv ..
-    opts = f'-p {pyexe} ' + ' '.join(args.args)
-    run(f'{uv} venv {opts.rstrip()} {vdir}')
-    if not vdir.exists():
-        return None
-
-    vdir = vdir.resolve()
+    reqfile = None
+    reqs = ''
     if not args.no_require:
         reqfile = get_requirements(args.requirements_file, DEFREQ)
+        if isinstance(reqfile, str):
+            return reqfile
         if reqfile:
-            if isinstance(reqfile, str):
-                return reqfile
-            run(f'{uv} pip install -p {vdir} -r "{reqfile}"')
+            reqs = reqfile.read_text()
+
+    python = get_python(uv, pyexe)
+
+    # Pin requirements in a lockfile, unless they depend on local files
+    locked = False
+    reqargs: list[str | Path] = ['-r', reqfile] if reqfile else []
+    if reqfile and python and not args.no_lock and not venvsync.LOCALREQ.search(reqs):
+        lock = Lockfile(get_source(reqfile), reqs, python)
+        if lock.pins is None:
+            print(f'### Pinning requirements in {lock.path} ..')
+            pins = compile_pins(uv, python[0], [reqfile])
+            if pins is None:
+                return f'Error: failed to pin requirements from {reqfile}'
 
-    if args.install:
-        pkgs = ' '.join(args.install)
-        run(f'{uv} pip install -p {vdir} {pkgs}')
+            lock.write(pins)
 
+        # Install straight from the pins, without resolving again unless
+        # extra packages also need to be resolved with them
+        reqfile, reqs = lock.path, lock.pins or ''
+        reqargs = ['-r', reqfile] if args.install else ['--no-deps', '-r', reqfile]
+        locked = True
+
+    # Fingerprint all inputs, to check if venv is current
+    fingerprint = python and venvsync.get_fingerprint(
+        [*python, version, args.args, vdir.name], reqs, args.install
+    )
+
+    if args.sync and python and venvsync.matches(vdir, python):
+        if venvsync.is_current(vdir, fingerprint):
+            print(f'### {vdir}/ is up to date')
+            return None
+
+        print(f'### Syncing existing {vdir}/ ..')
+        sync(uv, vdir.resolve(), reqfile, args)
+    else:
+        if vdir.exists():
+            print(f'### Removing existing {vdir}/ ..')
+            trash.move(vdir)
+
+        # Create the venv ..
+        if python and fingerprint and not args.no_cache:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                # Cache key must be of exactly the packages installed, so
+                # resolve them unless they are all pinned already
+                key = fingerprint
+                if args.install or (reqfile and not locked):
+                    reqfiles = [reqfile] if reqfile else []
+                    if args.install:
+                        extrafile = Path(tmpdir, 'extras.in')
+                        extrafile.write_text('\n'.join(args.install) + '\n')
+                        reqfiles.append(extrafile)
+
+                    pins = compile_pins(uv, python[0], reqfiles)
+                    if pins is None:
+                        return 'Error: failed to resolve requirements'
+
+                    pinfile = Path(tmpdir, 'requirements.txt')
+                    pinfile.write_text(pins + '\n')
+                    reqargs = ['--no-deps', '-r', pinfile]
+                    key = get_hash(json.dumps([fingerprint, pins]))
+
+                if not from_cache(key, uv, pyexe, args, vdir, reqargs):
+                    return None
+        elif not build(uv, pyexe, args.args, vdir, reqargs, args.install):
+            return None
+
+    venvsync.save(vdir, fingerprint)
+
+    # Record venv in the host index of installs
+    index.record_venv(vdir, [str(pyexe), version, args.args, reqs, args.install])
     return None
+
+
+def main(args: Namespace) -> str | None:
+    "Called to action this command"
+    # Any existing venv is moved aside, then deleted in the background
+    # while the new venv is created
+    trash = Trash(jobs=args.jobs, detach=args.detach)
+    trash.cleanup(Path(args.dir).absolute().parent)
+    try:
+        return create(args, trash)
+    finally:
+        trash.finish()
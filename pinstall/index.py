@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+"Common module to record everything installed on this host in a local index"
+
+from __future__ import annotations
+
+import getpass
+import json
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Iterable
+
+from .manifest import get_hash
+from .userdirs import NAME, state_dir
+
+INDEXFILE = 'inventory.db'
+
+# Directory of index of system installs
+SYSTEM_DIR = Path('/var/lib', NAME)
+
+SCHEMA = """\
+CREATE TABLE IF NOT EXISTS installs (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    source TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    user TEXT NOT NULL,
+    installed REAL NOT NULL,
+    PRIMARY KEY (kind, name, scope)
+)"""
+
+# Insert new installs, then update all, keeping original install time if
+# content has not changed. Does not use UPSERT, which older SQLite lacks.
+INSERT = 'INSERT OR IGNORE INTO installs VALUES (?, ?, ?, ?, ?, ?, ?)'
+UPDATE = """\
+UPDATE installs SET
+    source = ?,
+    user = ?,
+    installed = CASE WHEN hash = ? THEN installed ELSE ? END,
+    hash = ?
+WHERE kind = ? AND name = ? AND scope = ?"""
+DELETE = 'DELETE FROM installs WHERE kind = ? AND name = ? AND scope = ?'
+
+
+def get_path(user: bool) -> Path:
+    "Return path of index for user or system installs"
+    return (state_dir() if user else SYSTEM_DIR) / INDEXFILE
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    "Return connection to given index, creating it if needed"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(path)
+    db.execute(SCHEMA)
+    return db
+
+
+def _write(path: Path, changes: list[tuple[str, list[tuple]]]) -> None:
+    "Apply given (statement, rows) changes to given index, in one step"
+    # The index is just a record, so never fail an install if it can't be
+    # updated
+    try:
+        db = _connect(path)
+        try:
+            with db:
+                for sql, rows in changes:
+                    db.executemany(sql, rows)
+        finally:
+            db.close()
+    except (OSError, sqlite3.Error) as e:
+        print(f'### Warning: can not update index {path}: {e}', file=sys.stderr)
+
+
+def record(
+    path: Path,
+    kind: str,
+    scope: str,
+    items: Iterable[tuple[str, str, str]],
+    user: str | None = None,
+) -> None:
+    "Record given (name, source, hash) installs in given index, in one step"
+    now = time.time()
+    user = user or getpass.getuser()
+    items = list(items)
+    inserts = [(kind, n, scope, s, h, user, now) for n, s, h in items]
+    updates = [(s, user, h, now, h, kind, n, scope) for n, s, h in items]
+    _write(path, [(INSERT, inserts), (UPDATE, updates)])
+
+
+def remove(path: Path, kind: str, scope: str, names: Iterable[str]) -> None:
+    "Remove given installs from given index, in one step"
+    if path.exists():
+        _write(path, [(DELETE, [(kind, n, scope) for n in names])])
+
+
+def record_venv(vdir: Path, inputs: list) -> None:
+    "Record given venv, built from given inputs, in the user index"
+    venv = (str(vdir.resolve()), str(Path.cwd()), get_hash(json.dumps(inputs)))
+    record(get_path(True), 'venv', 'user', [venv])
+
+
+def remove_venv(vdir: Path) -> None:
+    "Remove given venv from the user index"
+    remove(get_path(True), 'venv', 'user', [str(vdir.resolve())])
+
+
+def query(
+    paths: Iterable[Path], kind: str | None = None, patterns: Iterable[str] = ()
+) -> list[dict]:
+    "Return installs recorded in given indexes, optionally filtered"
+    sql = 'SELECT * FROM installs WHERE 1'
+    params: list[str] = []
+    if kind:
+        sql += ' AND kind = ?'
+        params.append(kind)
+
+    if patterns := list(patterns):
+        sql += ' AND (' + ' OR '.join(['name GLOB ?'] * len(patterns)) + ')'
+        params.extend(patterns)
+
+    rows = []
+    for path in paths:
+        # Open read only, so system index can be read by any user
+        if not os.access(path, os.R_OK):
+            continue
+
+        db = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        db.row_factory = sqlite3.Row
+        try:
+            rows.extend(dict(r) for r in db.execute(sql, params))
+        except sqlite3.Error:
+            pass
+        finally:
+            db.close()
+
+    return sorted(rows, key=lambda r: (r['kind'], r['scope'], r['name']))
@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+"Common module to keep requirements pinned in a lockfile next to the project"
+
+from __future__ import annotations
+
+import json
+import os
+import platform
+import sys
+from pathlib import Path
+
+from .manifest import get_hash
+from .userdirs import NAME
+
+SUFFIX = '.lock'
+
+
+class Lockfile:
+    "Lockfile of pinned requirements, and hash of inputs they were pinned from"
+
+    def __init__(self, source: Path, reqs: str, python: tuple[str, str]):
+        self.path = source.with_suffix(SUFFIX)
+        self.source = source
+
+        # Pins only depend on the Python major and minor version, and on
+        # the platform since they are resolved for the current platform
+        minor = '.'.join(python[1].split()[1].split('.')[:2])
+        plat = [sys.platform, platform.machine()]
+        self.hash = get_hash(json.dumps([reqs, minor, *plat]))
+        self.pins = self._read()
+
+    def _read(self) -> str | None:
+        "Return pins in lockfile if pinned from current inputs, else None"
+        try:
+            text = self.path.read_text()
+        except OSError:
+            return None
+
+        header, _, pins = text.partition('\n')
+        return pins if header.endswith(f' {self.hash}') else None
+
+    def write(self, pins: str) -> None:
+        "Write given pins to the lockfile atomically"
+        header = f'# Pinned by {NAME} from {self.source.name}, inputs {self.hash}'
+        pins = pins.strip() + '\n'
+        tmpfile = self.path.with_name(f'{self.path.name}.{os.getpid()}')
+        tmpfile.write_text(f'{header}\n{pins}')
+        tmpfile.replace(self.path)
+        self.pins = pins
+
+
+def pins_from_report(report: str | None) -> str | None:
+    "Return pins of packages in given pip install report, or None if invalid"
+    try:
+        installs = json.loads(report or '')['install']
+        pins = sorted(
+            f'{i["metadata"]["name"]}=={i["metadata"]["version"]}' for i in installs
+        )
+    except Exception:
+        return None
+
+    return '\n'.join(sorted(pins, key=str.lower))
@@ -6,33 +6,118 @@ from __future__ import annotations
 
 import argparse
 import importlib
+import json
+import os
 import sys
 from pathlib import Path
 
+from .userdirs import cache_dir
+
 PROG = Path(__file__).parent
 
+# Cached manifest of commands so we only need to import the command run
+MANIFEST = 'commands.json'
+
+# Main options which take a separate value argument
+VALUE_OPTS = {'-j', '--jobs'}
+
+
+def _get_signature() -> dict[str, list[int]]:
+    "Return signature of all command module files to check manifest is current"
+    sig = {}
+    for modfile in sorted((PROG / 'commands').glob('[!_]*.py')):
+        stat = modfile.stat()
+        sig[modfile.stem] = [stat.st_mtime_ns, stat.st_size]
+
+    return sig
+
+
+def _build_manifest(sig: dict[str, list[int]]) -> dict:
+    "Import all command modules to build the command manifest"
+    commands = {}
+    for name in sig:
+        mod = importlib.import_module(f'{PROG.stem}.commands.{name}')
+        commands[name] = {
+            'doc': mod.__doc__,
+            'aliases': list(mod.aliases) if hasattr(mod, 'aliases') else [],
+        }
+
+    return {'dir': str(PROG), 'sig': sig, 'commands': commands}
+
+
+def get_manifest() -> dict[str, dict]:
+    "Return manifest of commands, rebuilding it if any command has changed"
+    sig = _get_signature()
+    manfile = cache_dir() / MANIFEST
+    try:
+        manifest = json.loads(manfile.read_text())
+    except Exception:
+        manifest = {}
+
+    if manifest.get('dir') != str(PROG) or manifest.get('sig') != sig:
+        manifest = _build_manifest(sig)
+
+        # Write new manifest atomically, but just carry on if we can't
+        tmpfile = manfile.with_name(f'{manfile.name}.{os.getpid()}')
+        try:
+            manfile.parent.mkdir(parents=True, exist_ok=True)
+            tmpfile.write_text(json.dumps(manifest, indent=2))
+            tmpfile.replace(manfile)
+        except Exception:
+            pass
+
+    return manifest['commands']
+
+
+def _get_command(argv: list[str]) -> str | None:
+    "Return the command name given on the command line, if any"
+    argv_iter = iter(argv)
+    for arg in argv_iter:
+        if arg in VALUE_OPTS:
+            next(argv_iter, None)
+        elif not arg.startswith('-'):
+            return arg
+
+    return None
+
 
 def main() -> str | None:
     "Main code"
     mainparser = argparse.ArgumentParser(description=__doc__)
+    mainparser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='maximum number of independent commands to run concurrently, '
+        'default is number of CPUs',
+    )
     subparser = mainparser.add_subparsers(title='Commands', dest='func')
 
-    # Iterate over the commands to set up their parsers
-    progs = {}
-    for modfile in sorted((PROG / 'commands').glob('[!_]*.py')):
-        name = modfile.stem
-        mod = importlib.import_module(f'{PROG.stem}.commands.{name}')
-        docstr = mod.__doc__.strip().split('\n\n')[0] if mod.__doc__ else None
-        aliases = mod.aliases if hasattr(mod, 'aliases') else []
+    # Set up parsers for all commands from the manifest
+    commands = get_manifest()
+    parsers = {}
+    names = {}
+    for name, cmd in commands.items():
+        doc = cmd['doc']
+        docstr = doc.strip().split('\n\n')[0] if doc else None
         parser = subparser.add_parser(
             name,
-            description=mod.__doc__,
+            description=doc,
             formatter_class=argparse.RawDescriptionHelpFormatter,
-            aliases=aliases, help=docstr,
+            aliases=cmd['aliases'],
+            help=docstr,
         )
-
-        progs[name] = parser.prog
-
+        parsers[name] = parser
+        names[name] = name
+        for alias in cmd['aliases']:
+            names[alias] = name
+
+    # Only import the module and add arguments for the command given
+    name = names.get(_get_command(sys.argv[1:]) or '')
+    if name:
+        parser = parsers[name]
+        mod = importlib.import_module(f'{PROG.stem}.commands.{name}')
         if hasattr(mod, 'init'):
             mod.init(parser)
 
@@ -47,7 +132,7 @@ def main() -> str | None:
         mainparser.print_help()
         return None
 
-    args._prog = progs[args.name]
+    args._prog = parsers[args.name].prog
 
     # Run the command that the user specified
     return args.func(args)
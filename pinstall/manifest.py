@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+"Common module to record installed files with their source and content hash"
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+# Steps done to a unit after install, recorded so they are redone if not done
+STEPS = ('enabled', 'started')
+
+
+def get_hash(data: str) -> str:
+    "Return hash of given string"
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _get_sig(path: Path) -> list[int] | None:
+    "Return signature of given file to detect if it has changed"
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+
+    return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+
+
+class Manifest:
+    "Record of installed target files, their source file, and content hash"
+
+    def __init__(self, path: Path):
+        self.path = path
+        try:
+            self.entries = json.loads(path.read_text())
+        except Exception:
+            self.entries = {}
+
+        self.changed = False
+
+    def unchanged(self, target: Path, source: Path, inputs: str) -> bool:
+        "Return True if target was installed from same source and inputs"
+        # Entries recorded by older versions lack wanted state, so must be
+        # checked again once to record it
+        entry = self.entries.get(str(target))
+        return bool(
+            entry
+            and entry['source'] == str(source)
+            and entry['inputs'] == inputs
+            and 'wanted' in entry
+            and entry['source_sig'] == _get_sig(source)
+            and entry['target_sig'] == _get_sig(target)
+        )
+
+    def installed(self, target: Path, chash: str) -> bool:
+        "Return True if target is unchanged since installed with content hash"
+        entry = self.entries.get(str(target))
+        return bool(
+            entry and entry['hash'] == chash and entry['target_sig'] == _get_sig(target)
+        )
+
+    def done(self, target: Path, step: str, chash: str | None = None) -> bool:
+        "Return True if given step was done since target installed with content"
+        entry = self.entries.get(str(target))
+        return bool(
+            entry and entry.get(step) and (chash is None or entry['hash'] == chash)
+        )
+
+    def wanted(self, target: Path) -> bool:
+        "Return True if target unit is wanted by another unit"
+        entry = self.entries.get(str(target))
+        return bool(entry and entry.get('wanted'))
+
+    def record(
+        self, target: Path, source: Path, inputs: str, chash: str, wanted: bool
+    ) -> None:
+        "Record given target as installed from given source, inputs, and content"
+        old = self.entries.get(str(target), {})
+        entry = {
+            'source': str(source),
+            'inputs': inputs,
+            'hash': chash,
+            'wanted': wanted,
+            'source_sig': _get_sig(source),
+            'target_sig': _get_sig(target),
+        }
+
+        # Steps done for previous content must be redone for new content
+        if old.get('hash') == chash:
+            entry.update((step, old[step]) for step in STEPS if step in old)
+
+        self.entries[str(target)] = entry
+        self.changed = True
+
+    def mark(self, target: Path, step: str, done: bool = True) -> None:
+        "Record given step as done, or not done, for given target"
+        entry = self.entries.get(str(target))
+        if entry is not None and bool(entry.get(step)) != done:
+            entry[step] = done
+            self.changed = True
+
+    def remove(self, target: Path) -> None:
+        "Remove record of given target"
+        if self.entries.pop(str(target), None):
+            self.changed = True
+
+    def save(self) -> None:
+        "Save manifest atomically, if it has changed"
+        if not self.changed:
+            return
+
+        tmpfile = self.path.with_name(f'{self.path.name}.{os.getpid()}')
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmpfile.write_text(json.dumps(self.entries, indent=2))
+        tmpfile.replace(self.path)
+        self.changed = False
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+"Common module to run probe commands, caching their output on disk"
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Callable, Sequence
+
+from .run import is_recording, run
+from .userdirs import cache_dir
+
+CACHEFILE = 'probes.json'
+
+# Maximum time to keep a cached result, in seconds
+TTL = 24 * 60 * 60
+
+
+def _read_cache(cachefile: Path) -> dict:
+    "Read and return the cache, or empty dict if none or invalid"
+    try:
+        return json.loads(cachefile.read_text())
+    except Exception:
+        return {}
+
+
+def _write_cache(cachefile: Path, cache: dict) -> None:
+    "Write the cache atomically, ignoring any failure"
+    tmpfile = cachefile.with_name(f'{cachefile.name}.{os.getpid()}')
+    try:
+        cachefile.parent.mkdir(parents=True, exist_ok=True)
+        tmpfile.write_text(json.dumps(cache, indent=2))
+        tmpfile.replace(cachefile)
+    except Exception:
+        pass
+
+
+def probe(
+    args: Sequence[str | Path],
+    *,
+    env: Sequence[str] = (),
+    check: Callable[[str], bool] | None = None,
+    ignore_error: bool = False,
+) -> str | None:
+    "Run given probe command, or return its cached output if still valid"
+    # Cached output is only valid if the executable has not changed
+    # since (i.e. same path, mtime, and inode) and the TTL has not
+    # expired. Values of any given environment variable names are added
+    # to the cache key. Optional check function can reject the output.
+    args = [str(a) for a in args]
+    exe = shutil.which(args[0])
+    if not exe or is_recording():
+        return run(args, capture=True, ignore_error=ignore_error)
+
+    exe = os.path.realpath(exe)
+    stat = os.stat(exe)
+    key = '\0'.join(args + [f'{e}={os.getenv(e, "")}' for e in env])
+    sig = [exe, stat.st_mtime_ns, stat.st_ino]
+
+    cachefile = cache_dir() / CACHEFILE
+    cache = _read_cache(cachefile)
+    now = time.time()
+    entry = cache.get(key)
+    if (
+        entry
+        and entry['sig'] == sig
+        and now - entry['time'] < TTL
+        and (not check or check(entry['out']))
+    ):
+        return entry['out']
+
+    out = run(args, capture=True, ignore_error=ignore_error)
+
+    # Only cache successful results, and prune any expired entries
+    cache = {k: v for k, v in cache.items() if now - v['time'] < TTL}
+    if out:
+        cache[key] = {'sig': sig, 'time': now, 'out': out}
+    else:
+        cache.pop(key, None)
+
+    _write_cache(cachefile, cache)
+    return out
@@ -52,3 +52,8 @@ def get_requirements(reqname: str, reqname_def: str) -> str | Path:
             reqfile = _reqfp and Path(_reqfp.name)
 
     return reqfile
+
+
+def get_source(reqfile: Path) -> Path:
+    "Return the file the given requirements file path was read or built from"
+    return Path(PYPROJ) if _reqfp and reqfile == Path(_reqfp.name) else reqfile
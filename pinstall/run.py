@@ -3,31 +3,193 @@
 
 from __future__ import annotations
 
+import json
+import os
+import shlex
 import subprocess
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Sequence
 
+# Environment variables to specify a file to record all commands run,
+# with their output and timing, or to replay previously recorded results
+# from instead of running the commands
+RECORD_ENV = 'PINSTALL_RECORD'
+REPLAY_ENV = 'PINSTALL_REPLAY'
 
-def run(cmd: str, *, capture: bool = False, ignore_error: bool = False) -> str | None:
-    "Run given command string"
-    if ignore_error:
-        cmd += ' 2>/dev/null'
+_lock = threading.Lock()
+_replays: dict[str, list[dict]] | None = None
+
+
+@dataclass
+class Result:
+    "Result of running a command"
+
+    args: list[str]
+    returncode: int
+    stdout: str | None
+    stderr: str | None
+    elapsed: float
+
+    @property
+    def ok(self) -> bool:
+        "Return True if command completed successfully"
+        return self.returncode == 0
+
+
+def is_recording() -> bool:
+    "Return True if commands are being recorded or replayed"
+    return bool(os.getenv(RECORD_ENV) or os.getenv(REPLAY_ENV))
+
+
+def _record(res: Result, input: str | None) -> None:
+    "Append given result to the record file"
+    rec = {
+        'args': res.args,
+        'input': input,
+        'returncode': res.returncode,
+        'stdout': res.stdout,
+        'stderr': res.stderr,
+        'elapsed': res.elapsed,
+    }
+    with _lock, open(os.environ[RECORD_ENV], 'a') as fp:
+        fp.write(json.dumps(rec) + '\n')
 
-    if capture:
-        stdout = subprocess.PIPE
-    else:
-        stdout = None
-        print(f'>>> Running {cmd}')
 
+def _replay(args: list[str]) -> Result:
+    "Return the recorded result for given command"
+    global _replays
+    with _lock:
+        if _replays is None:
+            _replays = {}
+            with open(os.environ[REPLAY_ENV]) as fp:
+                for line in fp:
+                    rec = json.loads(line)
+                    _replays.setdefault(shlex.join(rec['args']), []).append(rec)
+
+        # Return recorded results in order, repeating the last as needed
+        key = shlex.join(args)
+        recs = _replays.get(key)
+        if not recs:
+            sys.exit(f'Error: no recorded result for "{key}"')
+
+        rec = recs.pop(0) if len(recs) > 1 else recs[0]
+
+    return Result(args, rec['returncode'], rec['stdout'], rec['stderr'], rec['elapsed'])
+
+
+def _execute(args: list[str], stdout: Any, stderr: Any, input: str | None) -> Result:
+    "Run given command argument list"
+    start = time.monotonic()
     try:
-        res = subprocess.run(cmd, shell=True, stdout=stdout, text=True)
-    except Exception as e:
-        if not capture and not ignore_error:
-            sys.exit(str(e))
-        return None
+        res = subprocess.run(args, input=input, stdout=stdout, stderr=stderr, text=True)
+    except OSError as e:
+        # Report same code as the shell does when command can't be run
+        return Result(args, 127, None, str(e), time.monotonic() - start)
+
+    return Result(
+        args, res.returncode, res.stdout, res.stderr, time.monotonic() - start
+    )
+
 
-    if res.returncode != 0:
+def execute(
+    args: Sequence[str | Path],
+    *,
+    capture: bool = True,
+    quiet: bool = False,
+    input: str | None = None,
+    log: Path | None = None,
+) -> Result:
+    "Run given command argument list directly (i.e. without a shell)"
+    args = [str(a) for a in args]
+    if os.getenv(REPLAY_ENV):
+        res = _replay(args)
+    else:
+        recording = bool(os.getenv(RECORD_ENV))
+        if log:
+            # All output goes only to the given log file
+            with log.open('w') as fp:
+                res = _execute(args, fp, subprocess.STDOUT, input)
+        elif capture or recording:
+            res = _execute(args, subprocess.PIPE, subprocess.PIPE, input)
+        else:
+            res = _execute(args, None, subprocess.DEVNULL if quiet else None, input)
+
+        if recording:
+            _record(res, input)
+
+        if capture or log or not recording:
+            return res
+
+    # Output of recorded command was captured so emulate it being output
+    if not capture:
+        if res.stdout:
+            print(res.stdout, end='', flush=True)
+        if res.stderr and not quiet:
+            print(res.stderr, end='', file=sys.stderr, flush=True)
+        res.stdout = res.stderr = None
+
+    return res
+
+
+def run(
+    args: Sequence[str | Path],
+    *,
+    capture: bool = False,
+    ignore_error: bool = False,
+    input: str | None = None,
+) -> str | None:
+    "Run given command argument list"
+    if not capture:
+        print(f'>>> Running {shlex.join(str(a) for a in args)}')
+
+    res = execute(args, capture=capture, quiet=ignore_error, input=input)
+
+    if res.stderr and not ignore_error:
+        print(res.stderr.rstrip(), file=sys.stderr)
+
+    if not res.ok:
         if not capture and not ignore_error:
             sys.exit(res.returncode)
         return None
 
     return res.stdout and res.stdout.strip()
+
+
+def run_all(
+    cmds: Sequence[Sequence[str | Path]],
+    *,
+    jobs: int = 1,
+    capture: bool = False,
+    ignore_error: bool = False,
+) -> list[str | None]:
+    "Run given independent commands concurrently, reporting output in order"
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        results = list(pool.map(lambda args: execute(args, quiet=ignore_error), cmds))
+
+    outputs: list[str | None] = []
+    failed = None
+    for res in results:
+        if not capture:
+            print(f'>>> Running {shlex.join(res.args)}')
+            if res.stdout:
+                print(res.stdout, end='')
+
+        if res.stderr and not ignore_error:
+            print(res.stderr.rstrip(), file=sys.stderr)
+
+        if res.ok:
+            outputs.append((res.stdout and res.stdout.strip()) if capture else None)
+        else:
+            outputs.append(None)
+            if not failed:
+                failed = res
+
+    if failed and not capture and not ignore_error:
+        sys.exit(failed.returncode)
+
+    return outputs
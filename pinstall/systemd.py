@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+"Common module to query and control systemd units"
+
+from __future__ import annotations
+
+import time
+from typing import Sequence
+
+from .run import run
+
+# Interval between polls of unit state, in seconds
+POLL = 0.2
+
+
+def show(sysctl: list[str], units: Sequence[str], props: Sequence[str]) -> list[dict]:
+    "Return given properties of all given units, using one systemctl call"
+    if not units:
+        return []
+
+    out = run([*sysctl, 'show', '-p', ','.join(props), '--', *units], capture=True)
+
+    # Output is a block of NAME=VALUE lines for each unit, in order
+    blocks = out.split('\n\n') if out else []
+    states = []
+    for block in blocks:
+        state = {}
+        for line in block.splitlines():
+            name, _, val = line.partition('=')
+            state[name] = val
+        states.append(state)
+
+    # Return empty state for any unit not reported
+    states.extend({} for _ in range(len(units) - len(states)))
+    return states
+
+
+def _check(state: dict[str, str], invocation: str) -> str | None:
+    "Return result of unit with given state since restart, or None if pending"
+    # Units are restarted without blocking, so ignore the state of the old
+    # instance until the unit has a new invocation. This does not compare
+    # timestamps, so also works when replaying results recorded earlier.
+    if state.get('InvocationID', invocation) == invocation:
+        return None
+
+    active = state.get('ActiveState')
+    if active in ('active', 'failed'):
+        return active
+
+    # A oneshot service may have already run and finished
+    if active == 'inactive':
+        return 'finished' if state.get('Result') == 'success' else 'failed'
+
+    return None
+
+
+def rollout(
+    sysctl: list[str], units: Sequence[str], *, jobs: int = 1, timeout: float = 30
+) -> list[str]:
+    "Restart units concurrently, wait for each to become ready, return failed"
+    props = [
+        'ActiveState',
+        'SubState',
+        'Result',
+        'ActiveEnterTimestampMonotonic',
+        'InactiveExitTimestampMonotonic',
+        'NextElapseUSecRealtime',
+        'InvocationID',
+    ]
+    pending = list(units)
+    starting: dict[str, tuple[int, str]] = {}
+    results: dict[str, tuple[str, float, dict]] = {}
+
+    # Keep up to given number of units starting at once
+    while pending or starting:
+        batch = pending[: max(jobs - len(starting), 0)]
+        if batch:
+            del pending[: len(batch)]
+            invocations = show(sysctl, batch, ['InvocationID'])
+            start_us = time.monotonic_ns() // 1000
+            run([*sysctl, 'restart', '--no-block', *batch])
+            for name, state in zip(batch, invocations):
+                starting[name] = (start_us, state.get('InvocationID', ''))
+
+        time.sleep(POLL)
+        now_us = time.monotonic_ns() // 1000
+        names = list(starting)
+        for name, state in zip(names, show(sysctl, names, props)):
+            start_us, invocation = starting[name]
+            result = _check(state, invocation)
+            if not result and now_us - start_us < timeout * 1_000_000:
+                continue
+
+            # Use time unit became active if known, but not if replayed
+            entered = int(state.get('ActiveEnterTimestampMonotonic') or 0)
+            done = result == 'active' and start_us <= entered <= now_us
+            done_us = entered if done else now_us
+            results[name] = (result or 'timeout', (done_us - start_us) / 1e6, state)
+            del starting[name]
+
+    # Report a summary of all units, in original order
+    print('### Rollout summary:')
+    failed = []
+    for name in units:
+        result, secs, state = results[name]
+        ok = result in ('active', 'finished')
+        if not ok:
+            failed.append(name)
+
+        desc = f'{result} ({state.get("SubState") or "unknown"})'
+        if nextrun := state.get('NextElapseUSecRealtime'):
+            desc += f', next run {nextrun}'
+
+        print(f'###   {"PASS" if ok else "FAIL"} {name:<32} {secs:6.1f}s  {desc}')
+
+    if failed:
+        run([*sysctl, '--no-pager', 'status', *failed], ignore_error=True)
+
+    return failed
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+"Common module to substitute #NAME# template strings in files"
+
+from __future__ import annotations
+
+import re
+from pathlib import Path
+
+# Template strings are upper case names wrapped in hash symbols
+TOKEN = re.compile(r'#([A-Z][A-Z0-9_]*)#')
+
+
+class Template:
+    "Template text compiled into literal text parts and template names"
+
+    def __init__(self, text: str):
+        # Split gives alternating literal text and template names
+        self.parts = TOKEN.split(text)
+        self.names = set(self.parts[1::2])
+
+    def render(self, values: dict[str, str]) -> tuple[str, set[str]]:
+        "Return text with given values substituted, plus set of unknown names"
+        parts = self.parts.copy()
+        for i in range(1, len(parts), 2):
+            name = parts[i]
+            parts[i] = values.get(name, f'#{name}#')
+
+        return ''.join(parts), self.names - values.keys()
+
+
+def load(path: Path) -> Template:
+    "Return compiled template for given file"
+    return Template(path.read_text())
+
+
+def read_env(path: Path) -> dict[str, str] | str:
+    "Return dict of NAME=VALUE template values in given file, or error message"
+    values = {}
+    try:
+        text = path.read_text()
+    except Exception as e:
+        return f'Error: can not read "{path}": {e}'
+
+    for num, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        name, sep, val = line.partition('=')
+        name = name.strip()
+        if not sep or not TOKEN.fullmatch(f'#{name}#'):
+            return f'Error: invalid line {num} in "{path}": {line}'
+
+        val = val.strip()
+        if len(val) >= 2 and val[0] == val[-1] and val[0] in '"\'':
+            val = val[1:-1]
+
+        values[name] = val
+
+    return values
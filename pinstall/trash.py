@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+"Common module to quickly move directories aside and delete them in background"
+
+from __future__ import annotations
+
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .userdirs import NAME
+
+# Name of trash dir created in the parent dir of directories moved aside
+TRASHDIR = f'.{NAME}-trash'
+
+# Code run by detached child process to delete directories
+DETACH_CODE = """\
+import shutil, sys
+for path in sys.argv[1:]:
+    shutil.rmtree(path, ignore_errors=True)
+"""
+
+
+class Trash:
+    "Moves directories aside atomically then deletes them in the background"
+
+    def __init__(self, *, jobs: int = 1, detach: bool = False):
+        self.detach = detach
+        self.pool = ThreadPoolExecutor(max_workers=max(jobs, 1))
+        self.paths: list[Path] = []
+        self.trashdirs: set[Path] = set()
+
+    def _delete(self, path: Path) -> None:
+        "Delete given trashed path, in the background"
+        self.paths.append(path)
+        if not self.detach:
+            self.pool.submit(shutil.rmtree, path, ignore_errors=True)
+
+    def move(self, path: Path) -> None:
+        "Move given directory to trash and start deleting it"
+        trash = path.absolute().parent / TRASHDIR
+        trash.mkdir(exist_ok=True)
+        self.trashdirs.add(trash)
+
+        # Ensure git ignores trash if this is within a git repo
+        gitignore = trash / '.gitignore'
+        if not gitignore.exists():
+            gitignore.write_text(f'# Automatically created by {NAME}\n*\n')
+
+        dest = trash / f'{path.name}.{os.getpid()}.{time.time_ns()}'
+        path.rename(dest)
+        self._delete(dest)
+
+    def cleanup(self, parent: Path) -> None:
+        "Delete any trash left in given parent dir from interrupted runs"
+        trash = parent.absolute() / TRASHDIR
+        if trash.is_dir():
+            self.trashdirs.add(trash)
+            for path in trash.iterdir():
+                if path.is_dir() and path not in self.paths:
+                    self._delete(path)
+
+    def finish(self) -> None:
+        "Wait for all deletions to finish, or hand them to a detached process"
+        if self.detach:
+            if self.paths:
+                subprocess.Popen(
+                    [sys.executable, '-c', DETACH_CODE, *self.paths],
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    start_new_session=True,
+                )
+        else:
+            self.pool.shutdown(wait=True)
+
+            # Remove trash dirs if now empty
+            for trash in self.trashdirs:
+                if not any(p.name != '.gitignore' for p in trash.iterdir()):
+                    shutil.rmtree(trash, ignore_errors=True)
+
+        self.paths.clear()
+        self.trashdirs.clear()
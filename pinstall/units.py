@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+"Common module to find systemd service files to install or report on"
+
+from __future__ import annotations
+
+import os
+import sys
+from argparse import ArgumentParser, Namespace
+from fnmatch import fnmatch
+from pathlib import Path
+
+# Directory name patterns always ignored when searching recursively
+IGNORES = ('.*', '__pycache__', 'node_modules', 'venv')
+
+
+def add_arguments(parser: ArgumentParser) -> None:
+    "Add arguments to specify service files to given command parser"
+    parser.add_argument(
+        '-R',
+        '--recursive',
+        action='store_true',
+        help='find service files in all directories under the root directory',
+    )
+    parser.add_argument(
+        '--root',
+        help='root directory to search, default is current directory, '
+        'implies --recursive',
+    )
+    parser.add_argument(
+        '-i',
+        '--ignore',
+        action='append',
+        default=[],
+        help='directory name or relative path pattern to not search, '
+        'can specify multiple times',
+    )
+    parser.add_argument('units', nargs='*', help='systemd service file[s]')
+
+
+def find(root: Path, ignores: list[str]) -> list[Path]:
+    "Return all service files under given root dir, in one pruned walk"
+    units = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        path = Path(dirpath)
+        rel = path.relative_to(root)
+
+        # Prune ignored dirs, and sort the rest to walk them in order
+        dirnames[:] = sorted(
+            d
+            for d in dirnames
+            if not any(fnmatch(d, p) or fnmatch(str(rel / d), p) for p in ignores)
+        )
+        units.extend(path / f for f in sorted(filenames) if f.endswith('.service'))
+
+    return units
+
+
+def get_units(args: Namespace) -> list[Path] | str:
+    "Return list of service files specified by user, or error message"
+    if args.recursive or args.root:
+        if args.units:
+            return 'Error: can not specify service files when searching recursively'
+
+        root = Path(args.root or '.').resolve()
+        if not root.is_dir():
+            return f'Error: "{root}" is not a directory'
+
+        units = find(root, [*IGNORES, *args.ignore])
+        if not units:
+            return f'There are no .service files under {root}'
+
+        return units
+
+    units = (
+        [Path(p) for p in args.units]
+        if args.units
+        else list(Path.cwd().glob('*.service'))
+    )
+
+    if not units:
+        return 'There are no .service files in this directory'
+
+    found = []
+    for unit in units:
+        if not unit.suffix.lower() == '.service':
+            unit = unit.with_suffix('.service')
+
+        if not unit.exists():
+            print(f'### {unit} does not exist', file=sys.stderr)
+            continue
+
+        found.append(unit)
+
+    return found
@@ -0,0 +1,39 @@
+#!/usr/bin/python3
+"Common module to return per-user directories for this program"
+
+from __future__ import annotations
+
+import os
+import sys
+from pathlib import Path
+
+NAME = Path(__file__).parent.name
+
+
+def cache_dir() -> Path:
+    "Return the user cache directory"
+    # Work this out directly on Linux, as it is needed on every startup
+    # for the command manifest and platformdirs is slow to import
+    if sys.platform == 'linux':
+        path = os.getenv('XDG_CACHE_HOME', '')
+        if not path.strip():
+            path = os.path.expanduser('~/.cache')
+        return Path(path, NAME)
+
+    import platformdirs
+
+    return platformdirs.user_cache_path(NAME)
+
+
+def log_dir() -> Path:
+    "Return the user log directory"
+    import platformdirs
+
+    return platformdirs.user_log_path(NAME)
+
+
+def state_dir() -> Path:
+    "Return the user state directory"
+    import platformdirs
+
+    return platformdirs.user_state_path(NAME)
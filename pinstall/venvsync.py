@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+"Common module to check if an existing venv can be synced instead of rebuilt"
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+
+from .manifest import get_hash
+from .probe import probe
+from .userdirs import NAME
+
+# File in venv recording the fingerprint of the inputs it was built from
+FINGERPRINT = f'.{NAME}-inputs'
+
+# Requirements which depend on local files, so the fingerprint of the
+# requirements text can not tell if they have changed
+LOCALREQ = re.compile(
+    r'^\s*(-e|--editable|-r|--requirement|-c|--constraint|\.|/|~)|file:', re.M
+)
+
+
+def get_python(pyexe: str) -> tuple[str, str] | None:
+    "Return real path and full version of given python, or None if not found"
+    path = shutil.which(pyexe)
+    if not path:
+        return None
+
+    path = os.path.realpath(path)
+    version = probe([path, '-VV'], ignore_error=True)
+    return (path, version) if version else None
+
+
+def get_fingerprint(inputs: list, reqs: str, install: list[str] | None) -> str | None:
+    "Return fingerprint of given inputs, or None if they depend on local files"
+    if LOCALREQ.search('\n'.join([reqs, *(install or [])])):
+        return None
+
+    return get_hash(json.dumps([*inputs, reqs, install]))
+
+
+def _read_cfg(vdir: Path) -> dict[str, str]:
+    "Return settings in pyvenv.cfg of given venv"
+    try:
+        text = (vdir / 'pyvenv.cfg').read_text()
+    except OSError:
+        return {}
+
+    cfg = {}
+    for line in text.splitlines():
+        name, sep, val = line.partition('=')
+        if sep:
+            cfg[name.strip()] = val.strip()
+
+    return cfg
+
+
+def matches(vdir: Path, python: tuple[str, str]) -> bool:
+    "Return True if given venv was created with given python and version"
+    cfg = _read_cfg(vdir)
+    home = cfg.get('home')
+    version = cfg.get('version_info') or cfg.get('version')
+    path, fullversion = python
+    return bool(
+        home
+        and os.path.realpath(home) == os.path.dirname(path)
+        and version
+        and fullversion.split()[1:2] == [version]
+    )
+
+
+def is_current(vdir: Path, fingerprint: str | None) -> bool:
+    "Return True if given venv was built from inputs with given fingerprint"
+    try:
+        return bool(fingerprint) and (vdir / FINGERPRINT).read_text() == fingerprint
+    except OSError:
+        return False
+
+
+def save(vdir: Path, fingerprint: str | None) -> None:
+    "Record fingerprint of inputs given venv was built from"
+    path = vdir / FINGERPRINT
+    if fingerprint:
+        path.write_text(fingerprint)
+    else:
+        path.unlink(missing_ok=True)